@@ -0,0 +1,186 @@
+"""
+A local HTTP stand-in for the Harvest v2 and Forecast APIs
+
+StandInServer answers real HTTP GETs from a SyntheticSource, so the grabbers' whole network path (connection pooling,
+gzip, JSON parsing, pagination, page concurrency and the RequestScheduler's retries) runs and can be measured without
+touching the live APIs. Each request can be slowed down by a fixed latency plus jitter, and a share of them answered
+with a 429 and a Retry-After header the way Harvest throttles.
+
+    $ python -m benchmarks.api_server small --port 8010 --latency 0.05 --throttle_rate 0.01
+    $ HARVEST_BASE_URL=http://127.0.0.1:8010/v2/ FORECAST_BASE_URL=http://127.0.0.1:8010/ python main.py all_tables
+
+run_benchmarks.py starts one of these itself when given --server.
+"""
+
+# Imports
+import sys
+import gzip
+import json
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+from time import sleep
+
+from benchmarks.synthetic_data import SyntheticSource, scales
+
+
+# Classes
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers each GET from the server's SyntheticSource, after any injected latency or throttling"""
+    # HTTP/1.1 keeps connections open, so the grabbers' connection pool is exercised the way it is against the APIs
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        stand_in.wait()
+
+        if stand_in.throttle():
+            self.__send__(status=429, payload={'message': 'Too many requests'},
+                          headers={'Retry-After': str(stand_in.retry_after)})
+            return
+
+        status, payload = stand_in.source.respond(url=stand_in.url + self.path)
+        self.__send__(status=status, payload=payload)
+
+    def log_message(self, format, *args):
+        # One line per request would drown out the load's own output
+        pass
+
+    def __send__(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=1)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandInServer(object):
+    """
+    Serves a SyntheticSource over HTTP on a background thread
+
+    Harvest is served under /v2/ and Forecast from the root, see harvest_base_url and forecast_base_url. Every request
+    waits latency seconds plus up to latency_jitter more, and throttle_rate of them (0.05 is 5%) get a 429 that asks
+    the client to wait retry_after seconds. The injected delays and throttles come from a seeded random, so two runs
+    with the same settings see the same pattern.
+    """
+    def __init__(self, source, host='127.0.0.1', port=0, latency=0.0, latency_jitter=0.0, throttle_rate=0.0,
+                 retry_after=1, seed=42):
+        self.source = source
+        self.latency = float(latency)
+        self.latency_jitter = float(latency_jitter)
+        self.throttle_rate = float(throttle_rate)
+        self.retry_after = int(retry_after)
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self.requests = 0
+        self.throttled = 0
+
+        # Port 0 lets the OS pick a free one
+        self.httpd = ThreadingHTTPServer((host, port), StandInHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stand_in = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{host}:{port}'.format(host=host, port=port)
+
+    @property
+    def harvest_base_url(self):
+        return self.url + '/v2/'
+
+    @property
+    def forecast_base_url(self):
+        return self.url + '/'
+
+    def start(self):
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def wait(self):
+        """Sleeps for this request's injected latency and counts the request"""
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.latency_jitter)
+        if delay > 0:
+            sleep(delay)
+
+    def throttle(self):
+        """Whether this request gets a 429"""
+        with self.lock:
+            throttled = self.throttle_rate > 0 and self.random.random() < self.throttle_rate
+            if throttled:
+                self.throttled += 1
+        return throttled
+
+    def stats(self):
+        return {'requests': self.requests, 'throttled': self.throttled, 'latency': self.latency,
+                'latency_jitter': self.latency_jitter, 'throttle_rate': self.throttle_rate,
+                'retry_after': self.retry_after}
+
+
+# Functions
+def process_args(argv):
+    parser = argparse.ArgumentParser(description='Serve synthetic Harvest v2 and Forecast data over local HTTP')
+    parser.add_argument('scale', nargs='?', default='small', choices=sorted(scales.keys()))
+    for count in ['people', 'clients', 'projects', 'tasks', 'time_entries', 'assignments']:
+        parser.add_argument('--' + count, type=int, help='override the scale\'s {} count'.format(count))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--deleted_percent', type=int, default=0,
+                        help='share of time entries and assignments left out, as if deleted at the source')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8010)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--latency_jitter', type=float, default=0.0,
+                        help='up to this many more seconds added at random')
+    parser.add_argument('--throttle_rate', type=float, default=0.0,
+                        help='share of requests answered with a 429, 0.05 is 5%%')
+    parser.add_argument('--retry_after', type=int, default=1, help='Retry-After seconds sent with each 429')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = process_args(argv)
+    counts = {k: v for k, v in vars(args).items() if k in scales[args.scale] and v is not None}
+    source = SyntheticSource.at_scale(args.scale, seed=args.seed, deleted_percent=args.deleted_percent, **counts)
+    server = StandInServer(source=source, host=args.host, port=args.port, latency=args.latency,
+                           latency_jitter=args.latency_jitter, throttle_rate=args.throttle_rate,
+                           retry_after=args.retry_after, seed=args.seed)
+
+    print('Serving {scale} synthetic data at {url} {counts}'.format(scale=args.scale, url=server.url,
+                                                                   counts=source.counts))
+    print('Point the grabbers at it with:')
+    print('  export HARVEST_BASE_URL={}'.format(server.harvest_base_url))
+    print('  export FORECAST_BASE_URL={}'.format(server.forecast_base_url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print('Served {requests} requests, {throttled} throttled'.format(**server.stats()))
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
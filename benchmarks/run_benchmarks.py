@@ -0,0 +1,283 @@
+"""
+Benchmarks every munge_ and sync_ stage against a seeded synthetic data set
+
+The real Harvester and Forecaster are used with their HTTP session swapped for one that answers from a SyntheticSource,
+so pagination, filtering and flattening are measured along with the database work. With --server the grabbers go
+over real HTTP to a local StandInServer instead (see api_server.py), which can add latency and 429s. The database is whatever DB_CONN
+points at: a SQLite file (benchmark.sqlite) when it's unset, or a local PostgreSQL. Its tables are dropped and
+recreated, so remote databases are refused.
+
+    $ python -m benchmarks.run_benchmarks small
+    $ DB_CONN=postgres://me@localhost/datarocket_bench python -m benchmarks.run_benchmarks large --time_entries 500000
+    $ python -m benchmarks.run_benchmarks small --server --latency 0.02 --throttle_rate 0.01
+    $ python -m benchmarks.run_benchmarks small --compare benchmarks/results/small_sqlite_20181001-120000.json
+
+Each stage reports wall time, peak RSS and rows/sec. Results are saved as JSON in benchmarks/results, and --compare
+flags any stage that got slower than a saved result by more than --tolerance.
+"""
+
+# Imports
+import os
+import sys
+import json
+import argparse
+import platform
+import resource
+from contextlib import ExitStack
+from datetime import datetime
+from threading import Thread, Event
+from time import perf_counter
+from urllib.parse import urlparse
+
+# Keep benchmark runs out of the unit test database, must happen before the controllers read the conf file
+os.environ.setdefault('SQLITE_FILE', 'benchmark.sqlite')
+
+from benchmarks.synthetic_data import SyntheticSource, SyntheticSession, scales
+from benchmarks.api_server import StandInServer
+from controllers.datagrabber import Harvester, Forecaster, RequestScheduler, make_http_session
+from controllers.datamunger import UberMunge
+from controllers.datacleanser import GarbageCollector
+from controllers.ormcontroller import db
+from controllers.utilitybot import metrics, full_load_datetime
+
+
+# Variables
+results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+local_hosts = {'localhost', '127.0.0.1', '::1', None}
+
+
+# Classes
+class RssSampler(object):
+    """Tracks the peak resident set size of the process while a stage runs by sampling it on a background thread"""
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = Event()
+        self.thread = Thread(target=self.__sample__, daemon=True)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def __sample__(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+class BenchmarkRun(object):
+    """
+    Loads a synthetic data set through UberMunge and GarbageCollector one stage at a time, measuring each
+
+    server_options, if given, are the StandInServer settings (latency, throttle_rate, ...) and both sources are served
+    over local HTTP with them. Otherwise the grabbers answer from the sources in process.
+    """
+    def __init__(self, source, sync_source, server_options=None):
+        self.source = source
+        self.sync_source = sync_source
+        self.server_options = server_options
+        self.servers = []
+        self.results = {}
+
+    def run(self):
+        with ExitStack() as stack:
+            if self.server_options is not None:
+                self.servers = [stack.enter_context(StandInServer(source=source, **self.server_options))
+                                for source in [self.source, self.sync_source]]
+            return self.__run_stages__()
+
+    def server_stats(self):
+        """Requests and injected throttles seen by the stand-in servers, summed over both"""
+        stats = {}
+        for server in self.servers:
+            for key, value in server.stats().items():
+                stats[key] = stats.get(key, 0) + value if key in ['requests', 'throttled'] else value
+        return stats
+
+    def __run_stages__(self):
+        db.drop_all_tables(with_all_data=True)
+        db.create_tables()
+
+        uber = UberMunge(is_test=True)
+        uber.harv, uber.fore = make_grabbers(self.source, server=self.servers[0] if self.servers else None)
+        # Pull everything, but write it the way the nightly diff load does. The full load's legacy table rebuild is
+        # PostgreSQL only.
+        uber.set_load_dates(is_full_load=True)
+        uber.is_full_load = False
+        uber.time_entry_last_updated = full_load_datetime
+
+        # The sync stages see a source with some records removed, so they have deletes to do
+        gc = GarbageCollector()
+        gc.harv, gc.fore = make_grabbers(self.sync_source, server=self.servers[1] if self.servers else None)
+
+        stages = [('munge_person', uber.munge_person),
+                  ('munge_client', uber.munge_client),
+                  ('munge_task', uber.munge_task),
+                  ('munge_project', uber.munge_project),
+                  ('munge_assignment', uber.munge_assignment),
+                  ('munge_time_entries', uber.munge_time_entries),
+                  ('sync_forecast_assignments', gc.sync_forecast_assignments),
+                  ('sync_harvest_time_entries', gc.sync_harvest_time_entries)]
+
+        for name, action in stages:
+            rows_before = stage_rows(name)
+            with RssSampler() as rss:
+                start = perf_counter()
+                action()
+                wall_seconds = perf_counter() - start
+            rows = stage_rows(name) - rows_before
+            self.results[name] = {'wall_seconds': round(wall_seconds, 3),
+                                  'peak_rss_mb': round(rss.peak / 1048576, 1),
+                                  'rows': rows,
+                                  'rows_per_sec': round(rows / wall_seconds, 1) if wall_seconds else None}
+        return self.results
+
+
+# Functions
+def make_grabbers(source, server=None):
+    """
+    A Harvester and Forecaster that answer from source, with a request budget that never makes them wait
+
+    Given a StandInServer they send real requests to it over their own connection pool instead.
+    """
+    scheduler = RequestScheduler(rate_limit=10 ** 9, rate_window=1)
+    harv = Harvester()
+    fore = Forecaster()
+    if server is not None:
+        session = make_http_session()
+        harv.harvest_base_url = server.harvest_base_url
+        fore.forecast_base_url = server.forecast_base_url
+    else:
+        session = SyntheticSession(source)
+    for grabber in [harv, fore]:
+        grabber.session = session
+        grabber.scheduler = scheduler
+    return harv, fore
+
+
+def stage_rows(name):
+    """Rows written or deleted so far by a stage, as counted in the run's load metrics"""
+    stage = metrics.stages.get(name, {})
+    return sum(stage.get(counter, 0) for counter in metrics.row_counters)
+
+
+def current_rss():
+    """Resident set size of this process in bytes, falling back to the peak so far where /proc isn't available"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        # ru_maxrss is in kilobytes on Linux but bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def compare_results(results, baseline, tolerance, min_seconds):
+    """Prints each stage's wall time against the baseline and returns the stages that slowed down past tolerance
+
+    A stage also has to lose more than min_seconds to count, so timer noise on very short stages isn't flagged.
+    """
+    regressions = []
+    print('Compared to {} ({})'.format(baseline['run_at'], baseline['db_provider']))
+    for name, stage in results['stages'].items():
+        base = baseline['stages'].get(name)
+        if not base or not base['wall_seconds']:
+            continue
+        change = stage['wall_seconds'] / base['wall_seconds'] - 1
+        flag = ''
+        if change > tolerance and stage['wall_seconds'] - base['wall_seconds'] > min_seconds:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('  {name}: {was:.2f}s -> {now:.2f}s ({change:+.0%}){flag}'.format(
+            name=name, was=base['wall_seconds'], now=stage['wall_seconds'], change=change, flag=flag))
+    return regressions
+
+
+def process_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the load stages on synthetic Harvest and Forecast data')
+    parser.add_argument('scale', nargs='?', default='small', choices=sorted(scales.keys()))
+    for count in ['people', 'clients', 'projects', 'tasks', 'time_entries', 'assignments']:
+        parser.add_argument('--' + count, type=int, help='override the scale\'s {} count'.format(count))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--deleted_percent', type=int, default=2,
+                        help='share of time entries and assignments the sync stages find deleted at the source')
+    parser.add_argument('--server', action='store_true',
+                        help='go over HTTP to a local stand-in server instead of answering in process')
+    parser.add_argument('--latency', type=float, default=0.0, help='with --server, seconds added to every request')
+    parser.add_argument('--latency_jitter', type=float, default=0.0,
+                        help='with --server, up to this many more seconds added at random')
+    parser.add_argument('--throttle_rate', type=float, default=0.0,
+                        help='with --server, share of requests answered with a 429, 0.05 is 5%%')
+    parser.add_argument('--retry_after', type=int, default=1, help='with --server, Retry-After seconds sent with a 429')
+    parser.add_argument('--compare', help='a saved result to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown over the compared result that counts as a regression, 0.2 is 20%%')
+    parser.add_argument('--min_seconds', type=float, default=0.1,
+                        help='smallest slowdown in seconds that counts as a regression')
+    parser.add_argument('--out', default=results_dir, help='directory the result is saved to')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = process_args(argv)
+
+    db_host = urlparse(os.environ['DB_CONN']).hostname if os.environ.get('DB_CONN') else None
+    if db_host not in local_hosts:
+        print('Refusing to benchmark against {}: the benchmark drops every table'.format(db_host))
+        return 2
+
+    counts = {k: v for k, v in vars(args).items() if k in scales[args.scale] and v is not None}
+    source = SyntheticSource.at_scale(args.scale, seed=args.seed, **counts)
+    sync_source = SyntheticSource.at_scale(args.scale, seed=args.seed, deleted_percent=args.deleted_percent,
+                                           anchor=source.anchor, **counts)
+
+    server_options = None
+    if args.server:
+        server_options = {'latency': args.latency, 'latency_jitter': args.latency_jitter,
+                          'throttle_rate': args.throttle_rate, 'retry_after': args.retry_after, 'seed': args.seed}
+
+    run = BenchmarkRun(source=source, sync_source=sync_source, server_options=server_options)
+    stages = run.run()
+    results = {'run_at': datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
+               'scale': args.scale,
+               'counts': source.counts,
+               'seed': args.seed,
+               'db_provider': db.provider_name,
+               'transport': 'server' if args.server else 'in_process',
+               'python': platform.python_version(),
+               'stages': stages,
+               'endpoints': metrics.summary()['endpoints']}
+    if args.server:
+        results.update(server=run.server_stats())
+
+    print('Stage results:')
+    for name, stage in stages.items():
+        print('  {name}: {wall_seconds:.2f}s, {rows} rows, {rows_per_sec} rows/s, peak RSS {peak_rss_mb} MB'.format(
+            name=name, **stage))
+    if args.server:
+        print('Stand-in servers answered {requests} requests, {throttled} with a 429'.format(**results['server']))
+
+    os.makedirs(args.out, exist_ok=True)
+    out_file = os.path.join(args.out, '{scale}_{db}_{transport}_{at}.json'.format(
+        scale=args.scale, db=db.provider_name, transport=results['transport'],
+        at=datetime.now().strftime('%Y%m%d-%H%M%S')))
+    with open(out_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Saved results to {}'.format(out_file))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(results=results, baseline=json.load(f), tolerance=args.tolerance,
+                                          min_seconds=args.min_seconds)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
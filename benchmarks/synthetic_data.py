@@ -0,0 +1,381 @@
+"""
+Seeded synthetic Harvest v2 and Forecast data at any scale
+
+SyntheticSource answers a request url the way the real APIs would, paginated the Harvest way with page, per_page,
+updated_since and links, so the code in datagrabber.py can be run end to end without the live APIs. Every record is
+worked out from the seed and its position, so the same seed always gives the same data and time entries are built a
+page at a time instead of being held in memory.
+"""
+
+# Imports
+import json
+from datetime import datetime, timedelta
+from math import ceil
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+
+# Variables
+harvest_datetime_format = '%Y-%m-%dT%H:%M:%SZ'
+forecast_datetime_format = '%Y-%m-%dT%H:%M:%S.%fZ'
+harvest_base_url = 'https://api.harvestapp.com/v2/'
+
+# Record counts for each endpoint at the named scales
+scales = {'tiny': {'people': 10, 'clients': 5, 'projects': 20, 'tasks': 10, 'time_entries': 1000, 'assignments': 100},
+          'small': {'people': 50, 'clients': 20, 'projects': 200, 'tasks': 30, 'time_entries': 20000,
+                    'assignments': 2000},
+          'medium': {'people': 200, 'clients': 300, 'projects': 1000, 'tasks': 60, 'time_entries': 200000,
+                     'assignments': 10000},
+          'large': {'people': 500, 'clients': 1000, 'projects': 5000, 'tasks': 100, 'time_entries': 2000000,
+                    'assignments': 50000}}
+
+role_names = ['Product Team', 'Technology', 'Design (Ops)', 'Design (Support)', 'ML Team', 'Strategy',
+              'Mission Control', 'Exec', 'Full-Time', 'Billable', 'Non-Billable', 'NV']
+
+# Forecast has a person, client and project for each Harvest one, but every tenth is a Forecast only orphan and its
+# Harvest namesake goes without a Forecast twin
+forecast_orphan_every = 10
+
+
+# Classes
+class SyntheticSource(object):
+    """
+    Harvest and Forecast payloads for a seeded data set
+
+    Time entries are updated one minute apart, ending at the anchor datetime, so updated_since cuts the set down the
+    same way it would on the live API. deleted_percent leaves that share of time entries and assignments out, so the
+    sync stages have something to delete from a data warehouse loaded by a source with none left out.
+    """
+    def __init__(self, seed=42, people=50, clients=20, projects=200, tasks=30, time_entries=20000, assignments=2000,
+                 per_page=100, deleted_percent=0, anchor=None):
+        self.seed = seed
+        self.counts = {'people': people, 'clients': clients, 'projects': projects, 'tasks': tasks,
+                       'time_entries': time_entries, 'assignments': assignments}
+        self.per_page = per_page
+        self.deleted_percent = deleted_percent
+        # Midnight today unless told otherwise, so the most recent entries fall inside the time entry sync's window
+        self.anchor = anchor or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.first_entry_at = self.anchor - timedelta(minutes=time_entries)
+
+        self.harvest = {'users': [self.__harvest_user__(i) for i in range(people)],
+                        'clients': [self.__harvest_client__(i) for i in range(clients)],
+                        'projects': [self.__harvest_project__(i) for i in range(projects)],
+                        'tasks': [self.__harvest_task__(i) for i in range(tasks)]}
+        self.forecast = {'people': self.__forecast_people__(),
+                         'clients': self.__forecast_clients__(),
+                         'projects': self.__forecast_projects__(),
+                         'assignments': [self.__forecast_assignment__(i) for i in range(assignments)
+                                         if not self.__is_deleted__(i, salt=7)]}
+
+    @classmethod
+    def at_scale(cls, scale, **kwargs):
+        """A source with the record counts of one of the named scales, any count can still be overridden"""
+        counts = dict(scales[scale])
+        counts.update(kwargs)
+        return cls(**counts)
+
+    def respond(self, url, params=None):
+        """
+        Answers a GET the way the live API would
+
+        Harvest urls have /v2/ in their path, anything else is treated as Forecast. Query string params and the params
+        argument are merged, the same as requests does.
+
+        :return: (status code, dict payload)
+        """
+        parsed = urlparse(url)
+        query = dict(parse_qsl(parsed.query))
+        query.update({k: str(v) for k, v in (params or {}).items()})
+        endpoint = parsed.path.rstrip('/').rsplit('/', 1)[-1]
+
+        if '/v2/' in parsed.path:
+            return self.__harvest_page__(url=url, endpoint=endpoint, query=query)
+        if endpoint in self.forecast:
+            return 200, {endpoint: self.forecast[endpoint]}
+        return 404, {'message': 'Not found'}
+
+    """
+    Harvest
+    """
+
+    def __harvest_page__(self, url, endpoint, query):
+        if endpoint not in self.harvest and endpoint != 'time_entries':
+            return 404, {'message': 'Not found'}
+
+        page = max(int(query.get('page', 1)), 1)
+        per_page = min(max(int(query.get('per_page', self.per_page)), 1), 2000)
+        updated_since = query.get('updated_since')
+
+        if endpoint == 'time_entries':
+            first, last = self.__time_entry_range__(updated_since)
+            total_entries = last - first
+            start = first + (page - 1) * per_page
+            records = [self.__harvest_time_entry__(i) for i in range(start, min(start + per_page, last))
+                       if not self.__is_deleted__(i, salt=3)]
+        else:
+            matching = self.harvest[endpoint]
+            if updated_since:
+                matching = [record for record in matching if record['updated_at'] >= updated_since]
+            total_entries = len(matching)
+            start = (page - 1) * per_page
+            records = matching[start:start + per_page]
+
+        total_pages = max(ceil(total_entries / per_page), 1)
+
+        def page_link(number):
+            link_query = dict(query)
+            link_query.update(page=number, per_page=per_page)
+            return '{base}?{q}'.format(base=url.split('?')[0], q=urlencode(link_query))
+
+        return 200, {endpoint: records,
+                     'per_page': per_page,
+                     'total_pages': total_pages,
+                     'total_entries': total_entries,
+                     'next_page': page + 1 if page < total_pages else None,
+                     'previous_page': page - 1 if page > 1 else None,
+                     'page': page,
+                     'links': {'first': page_link(1),
+                               'next': page_link(page + 1) if page < total_pages else None,
+                               'previous': page_link(page - 1) if page > 1 else None,
+                               'last': page_link(total_pages)}}
+
+    def __time_entry_range__(self, updated_since):
+        """Index range of the time entries updated at or after updated_since"""
+        total = self.counts['time_entries']
+        if not updated_since:
+            return 0, total
+        since = datetime.strptime(updated_since[:19], harvest_datetime_format[:-1])
+        # Entry i is updated i + 1 minutes after first_entry_at
+        first = ceil((since - self.first_entry_at).total_seconds() / 60) - 1
+        return min(max(first, 0), total), total
+
+    def __harvest_user__(self, i):
+        roles = [role_names[self.__pick__(i, salt=11 + n, n=len(role_names))] for n in range(2)]
+        return {'id': 1000000 + i,
+                'first_name': 'First{}'.format(i),
+                'last_name': 'Last{}'.format(i),
+                'email': 'person{}@example.com'.format(i),
+                'telephone': '',
+                'timezone': 'Central Time (US & Canada)',
+                'has_access_to_all_future_projects': False,
+                'is_contractor': self.__pick__(i, salt=12, n=5) == 0,
+                'is_admin': False,
+                'is_project_manager': False,
+                'can_see_rates': False,
+                'can_create_projects': False,
+                'can_create_invoices': False,
+                'is_active': self.__pick__(i, salt=13, n=8) != 0,
+                'weekly_capacity': 144000,
+                'default_hourly_rate': 150.0,
+                'cost_rate': None,
+                'roles': sorted(set(roles)),
+                'avatar_url': 'https://example.com/avatar/{}.png'.format(i),
+                'created_at': self.__harvest_time__(i, days=900),
+                'updated_at': self.__harvest_time__(i, days=30)}
+
+    def __harvest_client__(self, i):
+        return {'id': 6000000 + i,
+                'name': 'Client {}'.format(i),
+                'is_active': self.__pick__(i, salt=21, n=6) != 0,
+                'address': '{} Main St'.format(i),
+                'created_at': self.__harvest_time__(i, days=900),
+                'updated_at': self.__harvest_time__(i, days=60),
+                'currency': 'USD'}
+
+    def __harvest_project__(self, i):
+        client_idx = self.__pick__(i, salt=31, n=self.counts['clients'])
+        starts_on = (self.anchor - timedelta(days=self.__pick__(i, salt=32, n=400))).strftime('%Y-%m-%d')
+        return {'id': 80000000 + i,
+                'name': 'Project {}'.format(i),
+                'code': 'P{:05d}'.format(i),
+                'is_active': self.__pick__(i, salt=33, n=5) != 0,
+                'is_billable': self.__pick__(i, salt=34, n=4) != 0,
+                'is_fixed_fee': False,
+                'bill_by': 'People',
+                'budget': None,
+                'budget_by': 'none',
+                'budget_is_monthly': False,
+                'notify_when_over_budget': False,
+                'over_budget_notification_percentage': 80,
+                'show_budget_to_all': False,
+                'created_at': self.__harvest_time__(i, days=900),
+                'updated_at': self.__harvest_time__(i, days=60),
+                'starts_on': starts_on if i % 3 else None,
+                'ends_on': None,
+                'over_budget_notification_date': None,
+                'notes': '',
+                'cost_budget': float(self.__pick__(i, salt=35, n=100) * 1000) if i % 4 == 0 else None,
+                'cost_budget_include_expenses': False,
+                'hourly_rate': None,
+                'fee': None,
+                'client': {'id': 6000000 + client_idx, 'name': 'Client {}'.format(client_idx), 'currency': 'USD'}}
+
+    def __harvest_task__(self, i):
+        return {'id': 11000000 + i,
+                'name': 'Task {}'.format(i),
+                'billable_by_default': True,
+                'default_hourly_rate': 150.0,
+                'is_default': False,
+                'is_active': True,
+                'created_at': self.__harvest_time__(i, days=900),
+                'updated_at': self.__harvest_time__(i, days=90)}
+
+    def __harvest_time_entry__(self, i):
+        project_idx = self.__pick__(i, salt=41, n=self.counts['projects'])
+        project = self.harvest['projects'][project_idx]
+        user_idx = self.__pick__(i, salt=42, n=self.counts['people'])
+        task_idx = self.__pick__(i, salt=43, n=self.counts['tasks'])
+        updated_at = self.first_entry_at + timedelta(minutes=i + 1)
+        spent_date = updated_at - timedelta(days=self.__pick__(i, salt=44, n=4))
+        billable = self.__pick__(i, salt=45, n=3) != 0
+        return {'id': 100000000 + i,
+                'spent_date': spent_date.strftime('%Y-%m-%d'),
+                'hours': (self.__pick__(i, salt=46, n=32) + 1) / 4,
+                'notes': 'Work item {}'.format(i),
+                'is_locked': False,
+                'locked_reason': None,
+                'is_closed': False,
+                'is_billed': False,
+                'timer_started_at': None,
+                'started_time': None,
+                'ended_time': None,
+                'is_running': False,
+                'billable': billable,
+                'budgeted': False,
+                'billable_rate': 150.0 if billable else None,
+                'cost_rate': None,
+                'created_at': (updated_at - timedelta(minutes=5)).strftime(harvest_datetime_format),
+                'updated_at': updated_at.strftime(harvest_datetime_format),
+                'user': {'id': 1000000 + user_idx, 'name': 'First{i} Last{i}'.format(i=user_idx)},
+                'client': dict(project['client']),
+                'project': {'id': project['id'], 'name': project['name'], 'code': project['code']},
+                'task': {'id': 11000000 + task_idx, 'name': 'Task {}'.format(task_idx)},
+                'user_assignment': {'id': 300000 + user_idx, 'is_project_manager': False, 'is_active': True,
+                                    'budget': None, 'hourly_rate': 150.0},
+                'task_assignment': {'id': 400000 + task_idx, 'billable': billable, 'is_active': True,
+                                    'hourly_rate': 150.0, 'budget': None},
+                'invoice': None,
+                'external_reference': None}
+
+    """
+    Forecast
+    """
+
+    def __forecast_people__(self):
+        people = []
+        for i in range(self.counts['people']):
+            harvest_user = self.__harvest_twin__('people', i)
+            people.append({'id': 700000 + i,
+                           'first_name': 'First{}'.format(i),
+                           'last_name': 'Last{}'.format(i),
+                           'email': 'person{}@example.com'.format(i),
+                           'login': 'enabled',
+                           'admin': False,
+                           'archived': self.__pick__(i, salt=51, n=8) == 0,
+                           'subscribed': False,
+                           'avatar_url': '',
+                           'roles': [],
+                           'updated_at': self.__forecast_time__(i, days=30),
+                           'updated_by_id': None,
+                           'harvest_user_id': 1000000 + harvest_user if harvest_user is not None else None,
+                           'weekly_capacity': None,
+                           'color_blind': False})
+        return people
+
+    def __forecast_clients__(self):
+        clients = []
+        for i in range(self.counts['clients']):
+            harvest_client = self.__harvest_twin__('clients', i)
+            clients.append({'id': 200000 + i,
+                            'name': 'Client {}'.format(i),
+                            'harvest_id': 6000000 + harvest_client if harvest_client is not None else None,
+                            'archived': False,
+                            'updated_at': self.__forecast_time__(i, days=60),
+                            'updated_by_id': None})
+        return clients
+
+    def __forecast_projects__(self):
+        clients = self.counts['clients']
+        projects = []
+        for i in range(self.counts['projects']):
+            harvest_project = self.__harvest_twin__('projects', i)
+            starts_on = (self.anchor - timedelta(days=self.__pick__(i, salt=61, n=400))).strftime('%Y-%m-%d')
+            projects.append({'id': 500000 + i,
+                             'name': 'Project {}'.format(i),
+                             'color': 'black',
+                             'code': 'P{:05d}'.format(i),
+                             'notes': None,
+                             'start_date': starts_on,
+                             'end_date': None,
+                             'harvest_id': 80000000 + harvest_project if harvest_project is not None else None,
+                             'archived': False,
+                             'updated_at': self.__forecast_time__(i, days=60),
+                             'updated_by_id': None,
+                             'client_id': 200000 + self.__pick__(i, salt=62, n=clients),
+                             'tags': []})
+        return projects
+
+    def __forecast_assignment__(self, i):
+        start = self.anchor.date() + timedelta(days=self.__pick__(i, salt=71, n=180) - 90)
+        end = start + timedelta(days=self.__pick__(i, salt=72, n=14))
+        # A few assignments are for placeholders, which have no person
+        person = self.__pick__(i, salt=73, n=self.counts['people'])
+        return {'id': 30000000 + i,
+                'start_date': start.strftime('%Y-%m-%d'),
+                'end_date': end.strftime('%Y-%m-%d'),
+                'allocation': 3600 * (self.__pick__(i, salt=74, n=8) + 1),
+                'notes': None,
+                'updated_at': self.__forecast_time__(i, days=30),
+                'updated_by_id': None,
+                'project_id': 500000 + self.__pick__(i, salt=75, n=self.counts['projects']),
+                'person_id': 700000 + person if self.__pick__(i, salt=76, n=20) else None,
+                'placeholder_id': None,
+                'repeated_assignment_set_id': None,
+                'active_on_days_off': False}
+
+    def __harvest_twin__(self, key, i):
+        """Index of the Harvest record a Forecast record is linked to, None for a Forecast only orphan"""
+        return None if i % forecast_orphan_every == 0 else i
+
+    """
+    Utility Methods
+    """
+
+    def __pick__(self, i, salt, n):
+        """A well spread number in range(n) for record i, the same for every run with the same seed"""
+        return (((i + 1) * 2654435761) ^ ((self.seed * 131 + salt) * 40503)) % 4294967291 % max(n, 1)
+
+    def __is_deleted__(self, i, salt):
+        return self.deleted_percent and self.__pick__(i, salt=salt + 1000, n=100) < self.deleted_percent
+
+    def __harvest_time__(self, i, days):
+        """A timestamp within days before the anchor, Harvest format"""
+        seconds = self.__pick__(i, salt=days, n=days * 86400)
+        return (self.anchor - timedelta(seconds=seconds)).strftime(harvest_datetime_format)
+
+    def __forecast_time__(self, i, days):
+        """A timestamp within days before the anchor, Forecast format with milliseconds"""
+        seconds = self.__pick__(i, salt=days + 1, n=days * 86400)
+        stamp = self.anchor - timedelta(seconds=seconds, milliseconds=self.__pick__(i, salt=days + 2, n=1000))
+        return stamp.strftime(forecast_datetime_format)[:-4] + 'Z'
+
+
+class SyntheticResponse(object):
+    """Just enough of a requests Response for the grabbers: status_code, text, headers and raise_for_status"""
+    def __init__(self, status_code, payload, headers=None):
+        self.status_code = status_code
+        self.text = json.dumps(payload)
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception('{code} from synthetic source'.format(code=self.status_code))
+
+
+class SyntheticSession(object):
+    """Stands in for the shared requests Session, answering every GET from a SyntheticSource in process"""
+    def __init__(self, source):
+        self.source = source
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        status_code, payload = self.source.respond(url=url, params=params)
+        return SyntheticResponse(status_code=status_code, payload=payload)
@@ -0,0 +1,184 @@
+"""
+File Purpose: Saves the raw Harvest and Forecast responses of a run, and replays them in place of the APIs
+A failed or slow load can then be rerun, or its transformations profiled, without a single API call
+"""
+
+# Imports
+import os
+import gzip
+import json
+import zlib
+from datetime import datetime
+from threading import Lock
+from urllib.parse import urlparse, parse_qsl, urlencode
+from data_rocket_conf import config as conf
+
+
+# Variables
+archive_dir = conf['ARCHIVE_DIR']
+run_id_format = '%Y%m%d-%H%M%S'
+# Params that move with the load dates. A replay falls back to matching without them, see ReplaySession
+window_params = ['updated_since', 'from', 'start_date', 'end_date']
+
+
+class ResponseArchive(object):
+    """
+    One run's raw API responses, stored as a gzip'd JSONL file per source and endpoint
+    e.g. archive/20181001-020000/harvest_time_entries.jsonl.gz, with one line per page:
+    {"path": ..., "query": ..., "status": ..., "body": ...}
+    """
+    def __init__(self, run_id=None, directory=archive_dir):
+        self.run_id = run_id or datetime.now().strftime(run_id_format)
+        self.path = os.path.join(directory, self.run_id)
+        self.files = {}
+        self.lock = Lock()
+
+    @classmethod
+    def for_replay(cls, run_id=conf['REPLAY_RUN'], directory=archive_dir):
+        """The archived run named by REPLAY_RUN, or the most recent one if it isn't set"""
+        if run_id:
+            archive = cls(run_id=run_id, directory=directory)
+            if not os.path.isdir(archive.path):
+                raise ValueError('No archived run {} in {}'.format(run_id, directory))
+            return archive
+        return cls.latest(directory=directory)
+
+    @classmethod
+    def latest(cls, directory=archive_dir):
+        """The most recent run archived in directory"""
+        runs = sorted(run for run in os.listdir(directory) if os.path.isdir(os.path.join(directory, run))) \
+            if os.path.isdir(directory) else []
+        if not runs:
+            raise ValueError('No archived runs in {}'.format(directory))
+        return cls(run_id=runs[-1], directory=directory)
+
+    def write(self, source, url, params, status, body):
+        """Appends one response to its endpoint's file, safe to call from the page worker threads"""
+        path, query = request_key(url=url, params=params)
+        line = json.dumps({'path': path, 'query': query, 'status': status, 'body': body}) + '\n'
+        name = file_name(source=source, path=path)
+
+        with self.lock:
+            if name not in self.files:
+                os.makedirs(self.path, exist_ok=True)
+                # Appended, so a second load in the same run adds to the file rather than replacing it. Level 5
+                # compresses about as well as the default 9 at a fraction of the cost.
+                self.files[name] = gzip.open(os.path.join(self.path, name), 'at', encoding='utf-8', compresslevel=5)
+            self.files[name].write(line)
+
+    def read(self, source, path):
+        """Yields each archived response of an endpoint in the order it was saved"""
+        full_path = os.path.join(self.path, file_name(source=source, path=path))
+        if not os.path.exists(full_path):
+            return
+        with gzip.open(full_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def close(self):
+        with self.lock:
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+
+
+class StoredResponse(object):
+    """
+    A response body kept from an earlier request, replayed from an archive or served from the HTTP cache
+    Just enough of a requests Response for the grabbers: status_code, text, headers and raise_for_status
+    """
+    def __init__(self, status_code, text, url):
+        self.status_code = status_code
+        self.text = text
+        self.url = url
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise ValueError('Stored {code} from {url}'.format(code=self.status_code, url=self.url))
+
+
+class ArchivingSession(object):
+    """Wraps a grabber's requests Session and saves every successful response it gets to a ResponseArchive"""
+    def __init__(self, session, archive, source):
+        self.session = session
+        self.archive = archive
+        self.source = source
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        r = self.session.get(url=url, headers=headers, params=params, timeout=timeout)
+        # Throttled and failed tries are retried by the scheduler, only the answer it keeps is worth replaying
+        if r.status_code < 400:
+            self.archive.write(source=self.source, url=url, params=params, status=r.status_code, body=r.text)
+        return r
+
+
+class ReplaySession(object):
+    """
+    Stands in for a grabber's requests Session, answering every GET from a ResponseArchive
+
+    Requests are matched on their path and params. A load run on another day asks for different dates, so if
+    there's no exact match the params that follow the load dates (updated_since, from, start_date, end_date) are left
+    out and the archived page with the rest of the same params is used, i.e. the replay sees the archived run's data.
+    Endpoints are read the first time they're asked for and held compressed, so a replay of a full load fits in memory.
+    Answers come from local_response, which RequestScheduler checks before the rate limit, so a replay runs as fast as
+    the munging allows.
+    """
+    def __init__(self, archive, source):
+        self.archive = archive
+        self.source = source
+        self.endpoints = {}
+        self.lock = Lock()
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        return self.local_response(url=url, params=params)
+
+    def local_response(self, url, params=None):
+        path, query = request_key(url=url, params=params)
+        exact, loose = self.__endpoint__(path)
+
+        record = exact.get(query)
+        if record is None:
+            record = loose.get(loose_query(query))
+        if record is None:
+            raise ValueError('No archived {source} response for {path}?{query} in run {run}'.format(
+                source=self.source, path=path, query=query, run=self.archive.run_id))
+
+        status, body = record
+        return StoredResponse(status_code=status, text=zlib.decompress(body).decode('utf-8'), url=url)
+
+    def __endpoint__(self, path):
+        with self.lock:
+            if path not in self.endpoints:
+                exact, loose = {}, {}
+                for response in self.archive.read(source=self.source, path=path):
+                    record = (response['status'], zlib.compress(response['body'].encode('utf-8'), 1))
+                    exact[response['query']] = record
+                    # The first one saved wins, e.g. a load's full pull over the sync's narrower one. A sync handed
+                    # more source records than it asked for only deletes less.
+                    loose.setdefault(loose_query(response['query']), record)
+                self.endpoints[path] = (exact, loose)
+            return self.endpoints[path]
+
+
+# Functions
+def request_key(url, params=None):
+    """
+    The path and a canonical query string of a request, the way requests would send it
+    Params in the url (e.g. a links.next url) and in params are merged, None values dropped and the keys sorted
+    """
+    parsed = urlparse(url)
+    query = dict(parse_qsl(parsed.query))
+    query.update({k: str(v) for k, v in (params or {}).items() if v is not None})
+    return parsed.path, urlencode(sorted(query.items()))
+
+
+def loose_query(query):
+    """A canonical query string without the params that follow the load dates"""
+    return urlencode([(k, v) for k, v in parse_qsl(query) if k not in window_params])
+
+
+def file_name(source, path):
+    """harvest + /v2/time_entries -> harvest_time_entries.jsonl.gz"""
+    endpoint = path.rstrip('/').rsplit('/', 1)[-1]
+    return '{source}_{endpoint}.jsonl.gz'.format(source=source, endpoint=endpoint)
@@ -5,19 +5,32 @@ Makes sure that deletions in source systems are found and represented in the Dat
 # Imports
 from controllers.datagrabber import Harvester, Forecaster
 from controllers.ormcontroller import *
-from controllers.utilitybot import datetime_format, date_format, datetime_format_ms, logger, full_load_datetime
+from controllers.utilitybot import datetime_format, date_format, datetime_format_ms, logger, full_load_datetime, metrics
 from datetime import datetime, timedelta
+from data_rocket_conf import config as conf
 import pandas as pd
+import numpy as np
 
 
 # Classes
 class GarbageCollector(object):
     """ Parent to all collectors these classes will find deleted entries in sources and remove from data warehouse."""
+    # How far back sync_harvest_time_entries looks for deleted time entries
+    time_entry_sync_days = 21
 
-    def __init__(self):
+    def __init__(self, sync_mode=conf['SYNC_MODE']):
         self.harv = Harvester()
         self.fore = Forecaster()
+        # 'server' lets the db find and delete missing rows, 'local' pulls the warehouse ids and diffs them in NumPy
+        self.sync_mode = sync_mode
+        # The run's SourceSnapshot, if PusherBot set one, holds what UberMunge already pulled
+        self.snapshot = None
 
+    def time_entry_sync_since(self):
+        """Start of the window sync_harvest_time_entries checks"""
+        return datetime.now() - timedelta(days=self.time_entry_sync_days)
+
+    @metrics.timed
     @db_session
     def sync_people_records(self):
         """Compares source People records with Data Warehouse and removes records that were deleted from source"""
@@ -65,87 +78,102 @@ class GarbageCollector(object):
             try:
                 e_id = int(entity[0])
                 Person[e_id].delete()
+                metrics.count('rows_deleted')
             except Exception as e:
-                logger.write_load_completion(str(e), "Fail while deleting person", success=False)
+                logger.record_error(description="Fail while deleting person", record_id=entity[0], error=e)
 
 
+    @metrics.timed
     @db_session
     def sync_forecast_assignments(self):
         """Finds deleted entries from Forecast and removes them from the Data Warehouse"""
-        # Get Source Data. Create list of dicts.
+        # Get Source Data. Just the ids are needed.
         print("Starting Time Assignments Sync")
         forecast_assignments = self.fore.get_forecast_assignments()['assignments']
-        assn_list = [{'fid': assn['id']} for assn in forecast_assignments]
-
-        # Get Data Warehouse Data. Create list of dicts.
-        dw_assignments = select(a for a in Time_Assignment)[:]
-        dw_assns = [{'dw_id': a.id, 'fid': a.parent_id} for a in dw_assignments]
-
-        # Make DataFrames of each
-        df_fore = pd.DataFrame(assn_list)
-        df_dw = pd.DataFrame(dw_assns)
+        source_ids = [assn['id'] for assn in forecast_assignments]
 
-        # Merge to make Super and Minor lists
-        df_super = df_dw.merge(df_fore, how='left', on='fid')
-        df_minor = df_dw.merge(df_fore, how='right', on='fid')
-
-        # Make lists of dicts, transform into sets of tuples
-        super_list = df_super.T.apply(lambda x: x.fillna(value=0).to_dict()).tolist()
-        super_list = [(dict['dw_id'], dict['fid']) for dict in super_list]
-        minor_list = df_minor.T.apply(lambda x: x.fillna(value=0).to_dict()).tolist()
-        minor_list = [(dict['dw_id'], dict['fid']) for dict in minor_list]
-
-        # Subtract the sets of super and minor list
-        df_subtractor = set(super_list) - set(minor_list)
-
-        # Loop through each entity in the set and delete from the Data Warehouse
-        print("Purging Deleted Time Assignments ({} Records)".format(len(df_subtractor)))
-        for entity in df_subtractor:
+        if self.sync_mode == 'server':
             try:
-                e_id = int(entity[0])
-                Time_Assignment[e_id].delete()
+                deleted_count = delete_missing_from_source(table_name='time_assignment', key_column='parent_id',
+                                                           source_ids=source_ids)
+                metrics.count('rows_deleted', deleted_count)
+                print("Purged Deleted Time Assignments ({} Records)".format(deleted_count))
             except Exception as e:
-                logger.write_load_completion(str(e), "Fail while deleting time assignment", success=False)
+                logger.record_error(description="Fail while deleting time assignments", record_id=None, error=e)
+            return
 
+        # Get Data Warehouse Data as flat id columns, no need to build entities
+        dw_assns = select((a.id, a.parent_id) for a in Time_Assignment)[:]
+        dw_ids = [dw_id for dw_id, parent_id in dw_assns]
+        dw_parent_ids = [parent_id for dw_id, parent_id in dw_assns]
 
+        # Any split assignment whose parent is no longer in Forecast gets deleted
+        deleted_ids = find_deleted_ids(dw_ids=dw_ids, dw_source_ids=dw_parent_ids, source_ids=source_ids)
+
+        print("Purging Deleted Time Assignments ({} Records)".format(len(deleted_ids)))
+        try:
+            deleted_count = delete_by_ids(table_name='time_assignment', ids=deleted_ids)
+            metrics.count('rows_deleted', deleted_count)
+        except Exception as e:
+            logger.record_error(description="Fail while deleting time assignments", record_id=None, error=e)
+
+    @metrics.timed
     @db_session
     def sync_harvest_time_entries(self):
         """Finds deleted entries from Harvest and removes them from the Data Warehouse"""
         print("Starting Time Entries Sync")
         # Set your updated date so you only need to pull a subset of time entries
-        updated_since = datetime.now() - timedelta(days=21)
+        updated_since = self.time_entry_sync_since()
         updated_since_str = datetime.strftime(updated_since, datetime_format_ms)
 
-        # Get Source Data. Create list of dicts.
-        harv_entries = self.harv.get_harvest_time_entries(updated_since=updated_since_str)['time_entries']
-        harv_entries = [{'id': entry['id']} for entry in harv_entries]
-
-        # Get Data Warehouse Data. Create list of dicts.
-        dw_entries = select(te for te in Time_Entry if te.updated_at > updated_since)[:]
-        dw_entries = [{'id': te.id} for te in dw_entries]
-
-        # Make DataFrames of each
-        df_harv = pd.DataFrame(harv_entries)
-        df_dw = pd.DataFrame(dw_entries)
-
-        # Merge to make Super and Minor lists
-        df_super = df_dw.merge(df_harv, how='left', on='id')
-        df_minor = df_dw.merge(df_harv, how='right', on='id')
-
-        # Make lists of dicts, transform into sets of tuples
-        super_list = df_super.T.apply(lambda x: x.fillna(value=0).to_dict()).tolist()
-        super_list = [(dict['id']) for dict in super_list]
-        minor_list = df_minor.T.apply(lambda x: x.fillna(value=0).to_dict()).tolist()
-        minor_list = [(dict['id']) for dict in minor_list]
-
-        # Subtract the sets of super and minor list
-        df_subtractor = set(super_list) - set(minor_list)
+        # Get Source Data. Just the ids are needed, munge_time_entries may already have pulled them this run.
+        source_ids = None
+        if self.snapshot is not None:
+            source_ids = self.snapshot.time_entries_since(datetime.strftime(updated_since, datetime_format))
+        if source_ids is None:
+            harv_entries = self.harv.get_harvest_time_entries(updated_since=updated_since_str)['time_entries']
+            source_ids = [entry['id'] for entry in harv_entries]
 
-        # Loop through each entity in the set and delete from the Data Warehouse
-        print("Purging Deleted Time Entries ({} Records)".format(len(df_subtractor)))
-        for entity in df_subtractor:
+        if self.sync_mode == 'server':
             try:
-                e_id = int(entity)
-                Time_Entry[e_id].delete()
+                deleted_count = delete_missing_from_source(table_name='time_entry', key_column='id',
+                                                           source_ids=source_ids, updated_since=updated_since)
+                # The legacy table mirrors time_entry, so the same anti-join finds the same rows there
+                delete_missing_from_source(table_name='harvest_entries', key_column='entry_id',
+                                           source_ids=source_ids, updated_since=updated_since)
+                metrics.count('rows_deleted', deleted_count)
+                print("Purged Deleted Time Entries ({} Records)".format(deleted_count))
             except Exception as e:
-                logger.write_load_completion(str(e), "Fail while deleting time entry", success=False)
\ No newline at end of file
+                logger.record_error(description="Fail while deleting time entries", record_id=None, error=e)
+            return
+
+        # Get Data Warehouse Data as a flat id column. Time entries keep the Harvest id as their primary key.
+        dw_ids = select(te.id for te in Time_Entry if te.updated_at > updated_since)[:]
+
+        deleted_ids = find_deleted_ids(dw_ids=dw_ids, dw_source_ids=dw_ids, source_ids=source_ids)
+
+        print("Purging Deleted Time Entries ({} Records)".format(len(deleted_ids)))
+        try:
+            deleted_count = delete_by_ids(table_name='time_entry', ids=deleted_ids)
+            metrics.count('rows_deleted', deleted_count)
+            delete_by_ids(table_name='harvest_entries', ids=deleted_ids, key_column='entry_id')
+        except Exception as e:
+            logger.record_error(description="Fail while deleting time entries", record_id=None, error=e)
+
+
+# Functions
+def find_deleted_ids(dw_ids, dw_source_ids, source_ids):
+    """Anti-join of data warehouse rows against the ids the source still has, done on NumPy arrays
+
+    :param dw_ids: data warehouse primary keys
+    :param dw_source_ids: the source id stored on each of those rows, in the same order. None never matches.
+    :param source_ids: every id the source system returned
+    :return: NumPy array of the data warehouse ids whose source record is gone
+    """
+    dw_ids = np.fromiter(dw_ids, dtype=np.int64, count=len(dw_ids))
+    dw_source_ids = np.fromiter((0 if i is None else i for i in dw_source_ids), dtype=np.int64,
+                                count=len(dw_source_ids))
+    source_ids = np.fromiter(source_ids, dtype=np.int64, count=len(source_ids))
+
+    missing = np.isin(dw_source_ids, source_ids, invert=True)
+    return dw_ids[missing]
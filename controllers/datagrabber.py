@@ -5,11 +5,19 @@ Currently supported: Harvest, Forecast
 
 # Imports
 import requests, json
+from requests.adapters import HTTPAdapter
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import calendar
+from itertools import chain, islice
+from threading import Lock
+from time import monotonic, sleep
+from urllib.parse import urlparse
+import calendar, random
 from data_rocket_conf import config as conf
-from controllers.utilitybot import logger, date_format, datetime_format, datetime_format_ms
+from controllers.utilitybot import logger, metrics, date_format, datetime_format, datetime_format_ms
+from controllers.ormcontroller import get_http_cache, set_http_cache
+from controllers.dataarchiver import StoredResponse, request_key
 
 
 # Variables
@@ -18,41 +26,313 @@ user_agent = conf['USER_AGENT']
 auth_token = conf['HARVEST_AUTH']
 harvest_account_id = conf['HARVEST_ACCOUNT_ID']
 from_date = conf['FROM_DATE']
+harvest_concurrency = int(conf['HARVEST_CONCURRENCY'])
+harvest_pagination = conf['HARVEST_PAGINATION']
+http_pool_size = int(conf['HTTP_POOL_SIZE'])
+# Seconds to wait for a connection and for each read of a response
+http_timeout = (float(conf['HTTP_CONNECT_TIMEOUT']), float(conf['HTTP_READ_TIMEOUT']))
+# Point these at a stand-in server (see benchmarks/api_server.py) to run the grabbers without the live APIs
+harvest_base_url = conf['HARVEST_BASE_URL']
+forecast_base_url = conf['FORECAST_BASE_URL']
+# Reference endpoints asked for with If-None-Match/If-Modified-Since, see CachedSession
+http_cache_paths = [path for path in conf['HTTP_CACHE_PATHS'].split(',') if path]
+
+
+def make_http_session(pool_size=http_pool_size):
+    """
+    Builds a requests Session that keeps connections alive and pools them per host
+    Every grabber shares one of these so a full load reuses a handful of connections instead of opening thousands
+    """
+    session = requests.Session()
+    # pool_connections is the number of hosts to keep pools for, pool_maxsize the connections kept per host.
+    # pool_block caps a host at pool_maxsize open connections instead of opening throwaway extras.
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+    return session
+
+
+class CachedSession(object):
+    """
+    Wraps a requests Session so GETs to reference endpoints are conditional
+
+    The ETag and Last-Modified of the last full response to each url and params are kept in the http_cache table and
+    sent back as If-None-Match/If-Modified-Since. A 304 is answered with the cached body, so an unchanged endpoint
+    costs one small round trip instead of a download. Other paths, and responses without either validator, are passed
+    straight through.
+    """
+    def __init__(self, session, paths=http_cache_paths):
+        self.session = session
+        self.paths = set(paths)
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        path, query = request_key(url=url, params=params)
+        if path not in self.paths:
+            return self.session.get(url=url, headers=headers, params=params, timeout=timeout)
+
+        # The host is part of the key so a stand-in server's responses never answer for the live API
+        key = '{host}{path}?{query}'.format(host=urlparse(url).netloc, path=path, query=query)
+        cached = get_http_cache(key)
+        headers = dict(headers or {})
+        if cached and cached['etag']:
+            headers.update({'If-None-Match': cached['etag']})
+        if cached and cached['last_modified']:
+            headers.update({'If-Modified-Since': cached['last_modified']})
+
+        r = self.session.get(url=url, headers=headers, params=params, timeout=timeout)
+        endpoint = path.rstrip('/').rsplit('/', 1)[-1]
+        if r.status_code == 304 and cached:
+            metrics.count_endpoint(endpoint=endpoint, counter='not_modified')
+            return StoredResponse(status_code=200, text=cached['body'], url=url)
+
+        etag, last_modified = r.headers.get('ETag'), r.headers.get('Last-Modified')
+        if r.status_code == 200 and (etag or last_modified):
+            try:
+                set_http_cache(key=key, etag=etag, last_modified=last_modified, body=r.text)
+            except Exception as e:
+                # e.g. two stages caching the same request at once. The response is still good, only the cache missed
+                print('Could not cache {ep} because {e}'.format(ep=endpoint, e=e))
+        return r
+
+
+class SourceSnapshot(object):
+    """
+    What one run has pulled from Harvest and Forecast, shared by UberMunge and GarbageCollector so nothing is pulled twice
+
+    Responses are kept by url and params, and a later identical request (say sync_forecast_assignments after
+    munge_assignment) gets the kept one. If two stages ask at once the second waits for the first's answer. Time entry
+    pages are too many to keep, so instead munge_time_entries pulls from whichever is earlier of its watermark and
+    time_entry_window, and records the ids updated since time_entry_window for sync_harvest_time_entries to use.
+    """
+    skip_paths = {'/v2/time_entries'}
+
+    def __init__(self, time_entry_window=None):
+        self.time_entry_window = time_entry_window
+        self.responses = {}
+        self.fetching = {}
+        self.time_entry_pull = None
+        self.lock = Lock()
+
+    def session(self, session):
+        """Wraps a grabber's session so its requests go through this snapshot"""
+        return SnapshotSession(session=session, snapshot=self)
+
+    def lookup(self, url, params=None):
+        """The kept response to a request, or None if this run hasn't had a good answer to it yet"""
+        path, query = request_key(url=url, params=params)
+        key = '{host}{path}?{query}'.format(host=urlparse(url).netloc, path=path, query=query)
+        if path in self.skip_paths or key not in self.responses:
+            return None
+        metrics.count_endpoint(endpoint=path.rstrip('/').rsplit('/', 1)[-1], counter='snapshot_hits')
+        return StoredResponse(status_code=200, text=self.responses[key], url=url)
+
+    def get(self, session, url, headers=None, params=None, timeout=None):
+        path, query = request_key(url=url, params=params)
+        if path in self.skip_paths:
+            return session.get(url=url, headers=headers, params=params, timeout=timeout)
+
+        key = '{host}{path}?{query}'.format(host=urlparse(url).netloc, path=path, query=query)
+        with self.lock:
+            key_lock = self.fetching.setdefault(key, Lock())
+
+        # Held through the request, so a second stage asking for the same page waits for this one's answer
+        with key_lock:
+            r = self.lookup(url=url, params=params)
+            if r is not None:
+                return r
+            r = session.get(url=url, headers=headers, params=params, timeout=timeout)
+            # Throttled and failed tries get retried, only a good answer is worth handing out again
+            if r.status_code == 200:
+                self.responses[key] = r.text
+            return r
+
+    def record_time_entries(self, since, ids):
+        """Keeps the ids of every time entry the source had updated at or after since"""
+        self.time_entry_pull = (since, list(ids))
+
+    def time_entries_since(self, since):
+        """Ids of the time entries updated at or after since, or None if this run didn't pull back that far"""
+        if self.time_entry_pull is None or self.time_entry_pull[0] > since:
+            return None
+        return self.time_entry_pull[1]
+
+
+class SnapshotSession(object):
+    """
+    A grabber's session with a SourceSnapshot in front of it
+    Kept responses are handed to RequestScheduler through local_response, so a hit costs no rate limit token and isn't
+    counted as a request. Only a request that's still in flight for another stage waits in get().
+    """
+    def __init__(self, session, snapshot):
+        self.session = session
+        self.snapshot = snapshot
+
+    def local_response(self, url, params=None):
+        r = self.snapshot.lookup(url=url, params=params)
+        # The session underneath may answer locally too, e.g. a replay
+        if r is None and hasattr(self.session, 'local_response'):
+            r = self.session.local_response(url=url, params=params)
+        return r
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        return self.snapshot.get(session=self.session, url=url, headers=headers, params=params, timeout=timeout)
+
+
+# The one session used by every Harvester and Forecaster
+http_session = CachedSession(make_http_session())
+
+
+class RequestScheduler(object):
+    """
+    Sliding window rate limit that every API request waits on, plus retries with backoff for throttled or failed GETs
+    The send times of the last rate_limit requests are kept, and a request only goes out once the oldest of them is
+    rate_window seconds old. No rate_window ever sees more than rate_limit requests, which is exactly how the API
+    counts, so a pull runs at the maximum rate the API allows without tripping it.
+    Every GET is sent with timeout, a (connect, read) pair of seconds, so a hung connection is retried instead of
+    blocking its worker thread forever.
+    """
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    def __init__(self, rate_limit=100, rate_window=15, max_retries=5, backoff_base=1, backoff_cap=60,
+                 timeout=http_timeout):
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+        # Send times of the requests still inside the window, oldest first
+        self.sent = deque()
+        # When the API throttles us, nobody sends again until this time
+        self.resume_at = 0
+        self.lock = Lock()
+
+    def acquire(self):
+        """Blocks until sending a request keeps every rate_window within rate_limit, and logs the send"""
+        while True:
+            with self.lock:
+                now = monotonic()
+                while self.sent and self.sent[0] <= now - self.rate_window:
+                    self.sent.popleft()
+                if now >= self.resume_at and len(self.sent) < self.rate_limit:
+                    self.sent.append(now)
+                    return
+                wait = self.resume_at - now
+                if len(self.sent) >= self.rate_limit:
+                    wait = max(wait, self.sent[0] + self.rate_window - now)
+            sleep(wait)
+
+    def hold(self, seconds):
+        """Stops every thread from sending for the given seconds"""
+        with self.lock:
+            self.resume_at = max(self.resume_at, monotonic() + seconds)
+
+    def get(self, session, url, headers=None, params=None):
+        """
+        Sends a GET once a token is available, retrying on 429/5xx and connection errors
+        Honors the Retry-After header when the API sends one, otherwise backs off exponentially with jitter.
+        Raises the last error once retries run out.
+        A session that can answer without the network (see ReplaySession) hands back its local_response before any of
+        that, so it neither waits on the rate limit nor counts as a request.
+        """
+        local_response = getattr(session, 'local_response', None)
+        if local_response is not None:
+            r = local_response(url=url, params=params)
+            if r is not None:
+                return r
+
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            try:
+                start = monotonic()
+                r = session.get(url=url, headers=headers, params=params, timeout=self.timeout)
+                if r.status_code not in self.retry_statuses:
+                    r.raise_for_status()
+                    # Track latency per endpoint, e.g. .../v2/time_entries?page=3 counts toward time_entries
+                    endpoint = urlparse(url).path.rstrip('/').rsplit('/', 1)[-1]
+                    metrics.record_request(endpoint=endpoint, seconds=monotonic() - start, retries=attempt)
+                    return r
+                error = requests.exceptions.HTTPError('{code} from {url}'.format(code=r.status_code, url=url),
+                                                      response=r)
+                retry_after = r.headers.get('Retry-After')
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+                r = None
+                retry_after = None
+
+            if attempt == self.max_retries:
+                break
+
+            # Full jitter keeps the worker threads from all retrying at the same instant
+            delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+            if retry_after and retry_after.isdigit():
+                delay = int(retry_after) + random.uniform(0, self.backoff_base)
+            if r is not None and r.status_code == 429:
+                self.hold(delay)
+            print('Retrying {url} in {d:.1f}s because {e}'.format(url=url, d=delay, e=error))
+            sleep(delay)
+
+        raise error
+
+
+# Harvest allows 100 requests per 15 seconds. Forecast uses the same account token so it shares the budget.
+request_scheduler = RequestScheduler(rate_limit=100, rate_window=15)
 
 
 class Harvester(object):
     # Hits Harvest endpoints and returns their data
-    harvest_base_url = 'https://api.harvestapp.com/v2/'
+    harvest_base_url = harvest_base_url
     entry_per_page = 100
     harvest_headers = {'Authorization': auth_token,
                        'Harvest-Account-ID': harvest_account_id,
                        'User-Agent': user_agent}
-    harvest_params = {'page_per': entry_per_page}
+    harvest_params = {'per_page': entry_per_page}
+    session = http_session
+    scheduler = request_scheduler
 
-    def __init__(self, is_test=False):
+    def __init__(self, is_test=False, concurrency=harvest_concurrency, pagination=harvest_pagination):
         self.is_test = is_test
+        self.concurrency = max(int(concurrency), 1)
+        # 'pages' fans page numbers out over the worker pool, 'links' follows links.next one page at a time
+        self.pagination = pagination
+        # Duplicate entries skipped during the last pull of each endpoint
+        self.duplicates_skipped = {}
 
     """
     All methods below start with get_ correspond to a Harvest v2 API endpoint by the same name as the root_key var
     Each has a filter list that cuts the number of fields down to what is important for the data warehouse
     """
 
+    time_entry_filters = ['id', 'spent_date', 'hours', 'billable', 'billable_rate', 'created_at', 'updated_at',
+                          'user', 'client', 'project', 'task']
+
+    @metrics.timed
     def get_harvest_time_entries(self, updated_since):
         root_key = 'time_entries'
-        filters = ['id', 'spent_date', 'hours', 'billable', 'billable_rate', 'created_at', 'updated_at',
-                   'user', 'client', 'project', 'task']
-
-        # Setup the endpoint params
-        time_entry_params = {}
-        time_entry_params.update(updated_since=updated_since) # Only pull entires updated since this date
-        time_entry_params.update({'from': from_date}) # If above param isn't present, will pull from this date
-        time_entry_params.update({'is_running': 'false'}) # Prevent pulling running timers
+        filters = self.time_entry_filters
+        time_entry_params = self.__time_entry_params__(updated_since=updated_since)
 
         # Perform data pull
         time_entry_dict = self.__get_api_data__(root_key=root_key, filters=filters,
                                                 extra_params=time_entry_params)
         return time_entry_dict
 
+    def iter_harvest_time_entries(self, updated_since):
+        """
+        Same pull as get_harvest_time_entries, but yields each entry as its page arrives instead of returning them all
+        Lets the caller write entries in chunks so memory stays flat no matter how much history is pulled
+        """
+        root_key = 'time_entries'
+        filters = self.time_entry_filters
+        time_entry_params = self.__time_entry_params__(updated_since=updated_since)
+
+        for page_json_result, flat_entities in self.__iter_api_pages__(root_key=root_key, filters=filters,
+                                                                       extra_params=time_entry_params):
+            for flat_entity in flat_entities:
+                yield flat_entity
+
+    @metrics.timed
     def get_harvest_users(self, updated_since):
         root_key = 'users'
         person_params = {}
@@ -64,6 +344,7 @@ class Harvester(object):
         users_dict = self.__get_api_data__(root_key=root_key, filters=filters, extra_params=person_params)
         return users_dict
 
+    @metrics.timed
     def get_harvest_clients(self, updated_since):
         root_key = 'clients'
         client_params = {}
@@ -74,6 +355,7 @@ class Harvester(object):
         clients_dict = self.__get_api_data__(root_key=root_key, filters=filters, extra_params=client_params)
         return clients_dict
 
+    @metrics.timed
     def get_harvest_projects(self, updated_since):
         root_key = 'projects'
         project_params = {}
@@ -85,6 +367,7 @@ class Harvester(object):
         projects_dict = self.__get_api_data__(root_key=root_key, filters=filters, extra_params=project_params)
         return projects_dict
 
+    @metrics.timed
     def get_harvest_tasks(self, updated_since):
         root_key = 'tasks'
         task_params = {}
@@ -100,6 +383,14 @@ class Harvester(object):
     These reduce code duplication and help keep the core methods as clean as possible
     """
 
+    def __time_entry_params__(self, updated_since):
+        # Setup the endpoint params
+        time_entry_params = {}
+        time_entry_params.update(updated_since=updated_since) # Only pull entires updated since this date
+        time_entry_params.update({'from': from_date}) # If above param isn't present, will pull from this date
+        time_entry_params.update({'is_running': 'false'}) # Prevent pulling running timers
+        return time_entry_params
+
     def __filter_results__(self, results_dict, filter_list):
         # Filter results from larger dictionary by subtracting a set of its keys against a given list
         result_keys = set(results_dict.keys())
@@ -147,69 +438,151 @@ class Harvester(object):
     def __get_request__(self, api_url, extra_params=None):
         """
         Will hit a harvest API and return result as json object - Called for each paginated result in Harvest API
+        A full url (like links.next) is requested as is, since it already carries all of its params
         """
-        full_url = self.harvest_base_url + api_url
         headers = self.harvest_headers
-        params = self.harvest_params
-        if extra_params:
-            params.update(extra_params)
+        if api_url.startswith('http'):
+            full_url = api_url
+            params = None
+        else:
+            full_url = self.harvest_base_url + api_url
+            # Copy the class params so concurrent page requests don't overwrite each other's page number
+            params = self.harvest_params.copy()
+            if extra_params:
+                params.update(extra_params)
 
         try:
-            r = requests.get(url=full_url, headers=headers, params=params)
+            r = self.scheduler.get(session=self.session, url=full_url, headers=headers, params=params)
             json_r = json.loads(r.text)
         except Exception as e:
-            json_r = {}
+            # A page we can't get would leave a hole in the data, so stop the pull rather than carry on without it
             print('Could not hit endpoint {ep} because {e}'.format(ep=api_url, e=e))
+            raise
 
         return json_r
 
-    def __get_api_data__(self, root_key, extra_params=None, filters=None):
+    def __get_pages__(self, root_key, api_params, page_numbers):
         """
-        Accepts params for Harvest endpoint and returns result set. Meant to be portable for all v2 endpoints.
+        Fetches the given page numbers over a bounded worker pool and yields the results in page order
+        At most concurrency pages are in flight, the next one is only requested as a finished one is handed on, so a
+        slow consumer holds a handful of pages in memory rather than every page fetched ahead of it.
+        """
+        def get_page(page_num):
+            page_params = api_params.copy()
+            page_params.update(page=page_num)
+            return self.__get_request__(api_url=root_key, extra_params=page_params)
+
+        if self.concurrency == 1:
+            for page_num in page_numbers:
+                yield get_page(page_num)
+        else:
+            page_numbers = iter(page_numbers)
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                in_flight = deque(executor.submit(get_page, page_num)
+                                  for page_num in islice(page_numbers, self.concurrency))
+                while in_flight:
+                    # Oldest first, so pages come back in the order they were asked for, not the order they finished
+                    page_json_result = in_flight.popleft().result()
+                    for page_num in islice(page_numbers, 1):
+                        in_flight.append(executor.submit(get_page, page_num))
+                    yield page_json_result
+
+    def __get_linked_pages__(self, first_page):
+        """
+        Yields the first page and then each page its links.next points at, until there is no next link
+        The next page is fetched on a background worker while the current one is being processed. Following the
+        links rather than precomputed page numbers keeps entries added mid-pull from being missed.
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            page_json_result = first_page
+            while page_json_result:
+                next_url = (page_json_result.get('links') or {}).get('next')
+                if next_url:
+                    next_page = executor.submit(self.__get_request__, api_url=next_url)
+                else:
+                    next_page = None
+
+                yield page_json_result
+
+                if next_page:
+                    page_json_result = next_page.result()
+                else:
+                    page_json_result = None
+
+    def __iter_api_pages__(self, root_key, extra_params=None, filters=None):
+        """
+        Walks every page of a Harvest endpoint and yields (page json, filtered and flattened entities) one page at a time
+        Page 1 tells us how many pages there are, the rest are fetched concurrently (see HARVEST_CONCURRENCY)
         """
         api_params = {}
         if extra_params:
             api_params.update(extra_params)
+        api_params.update(page=1)
         api_json_result = self.__get_request__(api_url=root_key, extra_params=api_params)
 
-        # Get page numbers, build queue
-        page_qty = api_json_result['total_pages']
-        page_queue = deque(range(1, (page_qty + 1)))
+        # Get page numbers, build queue of the pages left after the first
         total_pages = api_json_result['total_pages']
         total_entries = api_json_result['total_entries']
+        page_queue = deque(range(2, (total_pages + 1)))
 
-        # Process the queue until empty
-        api_list = []
-        # Keep track of ids added to list to prevent inserting multiple of the same record
-        id_list = []
-        api_json_result.update(id_list=id_list)
+        # Keep track of ids already yielded to prevent passing on multiple of the same record. A set keeps the check
+        # constant time, a list made full time entry pulls quadratic.
+        seen_ids = set()
+        # Entries that shift pages while we pull show up twice, count them so the load log shows how often it happens
+        duplicate_count = 0
 
         print('Starting {name} Harvest Pull ({entries} Entries, {pages} Pages)'.format(name=root_key.capitalize(),
                                                                                        entries=total_entries,
                                                                                        pages=total_pages))
-        while len(page_queue) > 0:
-            page_num = page_queue.popleft()
-            api_params.update(page=page_num)
-            # Request api load for the current page
-            page_json_result = self.__get_request__(api_url=root_key, extra_params=api_params)
+        progress = logger.progress(total=total_pages, prefix='{} Pages'.format(root_key.capitalize()))
+        # Reuse the first page's payload rather than requesting it again
+        if self.pagination == 'links':
+            page_results = self.__get_linked_pages__(first_page=api_json_result)
+        else:
+            page_results = chain([api_json_result], self.__get_pages__(root_key=root_key, api_params=api_params,
+                                                                       page_numbers=page_queue))
+        for page_json_result in page_results:
             api_entities = page_json_result[root_key]
-            # print(
-            #     'Processing Page: ' + str(page_json_result['page']) + ' out of ' + str(page_json_result['total_pages']))
+            flat_entities = []
 
-            # If there are keys to filter, do that. Otherwise just add the entire resposne to the api_list
+            # If there are keys to filter, do that. Otherwise just add the entire resposne to the list
             for entity in api_entities:
-                if entity['id'] not in api_json_result['id_list']:
+                if entity['id'] not in seen_ids:
                     entity = self.__filter_results__(results_dict=entity, filter_list=filters)
                     # Some results have sub-dictionaries so we want to flatten them
                     flat_entity = self.__flatten_results__(entity)
-                    api_list.append(flat_entity)
-                    id_list.append(flat_entity['id'])
+                    flat_entities.append(flat_entity)
+                    seen_ids.add(flat_entity['id'])
                 else:
-                    pass
+                    duplicate_count += 1
 
-            logger.print_progress_bar(iteration=page_json_result['page'], total=total_pages)
+            progress.update(page_json_result['page'])
+            yield page_json_result, flat_entities
+
+        self.duplicates_skipped.update({root_key: duplicate_count})
+        # These land in the run's load metrics document in the load log
+        metrics.count_endpoint(endpoint=root_key, counter='entries', amount=len(seen_ids))
+        metrics.count_endpoint(endpoint=root_key, counter='duplicates_skipped', amount=duplicate_count)
+
+    def __get_api_data__(self, root_key, extra_params=None, filters=None):
+        """
+        Accepts params for Harvest endpoint and returns result set. Meant to be portable for all v2 endpoints.
+        """
+        api_json_result = None
+        api_list = []
+        id_list = []
+
+        for page_json_result, flat_entities in self.__iter_api_pages__(root_key=root_key, extra_params=extra_params,
+                                                                       filters=filters):
+            # The first page doubles as the result set we hand back
+            if api_json_result is None:
+                api_json_result = page_json_result
+            api_list.extend(flat_entities)
+            id_list.extend([flat_entity['id'] for flat_entity in flat_entities])
 
         # Replace the endpoint data with our updated info
+        api_json_result.update(id_list=id_list)
+        api_json_result.update(duplicates_skipped=self.duplicates_skipped[root_key])
         api_json_result.update({root_key: api_list})
 
         return api_json_result
@@ -217,11 +590,13 @@ class Harvester(object):
 
 class Forecaster(object):
     # Grabs Forecast data - Note that the Forecast API is not officially supported
-    forecast_base_url = 'https://api.forecastapp.com/'
+    forecast_base_url = forecast_base_url
     forecast_headers = {'Authorization': auth_token,
                              'Forecast-Account-ID': forecast_account_id,
                              'User-Agent': user_agent}
     forecast_params = {}
+    session = http_session
+    scheduler = request_scheduler
 
     def __init__(self, is_test=False):
         self.is_test = is_test
@@ -231,6 +606,7 @@ class Forecaster(object):
     There is also a set of filters for each endpoint to limit fields being sent downstream
     """
 
+    @metrics.timed
     def get_forecast_projects(self):
         print('Getting Forecast Projects')
         api_url = 'projects'
@@ -245,6 +621,7 @@ class Forecaster(object):
             project.update(ends_on=project.pop('end_date'))
         return projects_json_result
 
+    @metrics.timed
     def get_forecast_people(self):
         print('Getting Forecast People')
         api_url = 'people'
@@ -257,6 +634,7 @@ class Forecaster(object):
             person.update(harvest_id = person.pop('harvest_user_id')) # Update to match the Harvest Field Name
         return people_json_result
 
+    @metrics.timed
     def get_forecast_assignments(self):
         print('Getting Forecast Assignments')
         api_url = 'assignments'
@@ -270,6 +648,7 @@ class Forecaster(object):
             assn = self.__filter_results__(results_dict=assn, filter_list=filters)
         return assignment_json_result
 
+    @metrics.timed
     def get_forecast_clients(self):
         print('Getting Forecast Clients')
         api_url = 'clients'
@@ -293,16 +672,18 @@ class Forecaster(object):
         """
         full_url = self.forecast_base_url + api_url
         headers = self.forecast_headers
-        params = self.forecast_params
+        # Copy the class params so one endpoint's extra params don't stick around for the next
+        params = self.forecast_params.copy()
         if extra_params:
             params.update(extra_params)
 
         # Perform api request
         try:
-            r = requests.get(url=full_url, headers=headers, params=params)
+            r = self.scheduler.get(session=self.session, url=full_url, headers=headers, params=params)
             api_json_result = json.loads(r.text)
         except Exception as e:
             print('Attempt for Forecast {url} failed because {e}'.format(url=api_url, e=e))
+            raise
 
         return api_json_result
 
@@ -6,12 +6,16 @@ It will greatly simplify the actions taken within the main.py file
 # Imports
 from controllers.datagrabber import Harvester, Forecaster
 from controllers.ormcontroller import *
-from controllers.utilitybot import datetime_format, date_format, datetime_format_ms, logger, full_load_datetime
+from controllers.utilitybot import datetime_format, date_format, datetime_format_ms, logger, full_load_datetime, chunked, \
+    metrics
 from datetime import datetime, timedelta
-from numpy import is_busday
+import numpy as np
 from data_rocket_conf import config as conf
 import json
 
+# Variables
+load_batch_size = int(conf['LOAD_BATCH_SIZE'])
+
 # Classes
 class UberMunge(object):
     """This class transforms data before sending off to the DB for insert or update
@@ -20,12 +24,50 @@ class UberMunge(object):
     update rather than load in a bulk transaction after all records are transformed.
     """
     def __init__(self, is_test=False):
+        # Resolves Harvest/Forecast ids to data warehouse ids, kept up to date as records are written
+        self.id_cache = IdCache()
+        # Source data pulled by the extract_ methods, waiting for its munge_ method
+        self.extracts = {}
+        # Newest updated_at written to each table this run, saved as its watermark when the munge_ method finishes
+        self.high_water = {}
+        # The run's SourceSnapshot, if PusherBot set one, shares what's pulled here with GarbageCollector
+        self.snapshot = None
         if is_test:
             pass
         else:
             self.harv = Harvester(is_test=is_test)
             self.fore = Forecaster(is_test=is_test)
-            self.last_updated_dict = get_updated_from_dates()
+            self.id_cache.load()
+
+    """
+    Extract Functions
+
+    These pull the source data for a munge function ahead of time so the API calls can run while other tables load.
+    Calling a munge function without its extract pulls the data then and there.
+    """
+
+    def extract_person(self):
+        harvest_people = self.harv.get_harvest_users(updated_since=self.person_last_updated)
+        forecast_people = self.fore.get_forecast_people()
+        self.extracts.update(person=(harvest_people, forecast_people))
+
+    def extract_client(self):
+        harvest_clients = self.harv.get_harvest_clients(updated_since=self.client_last_updated)
+        forecast_clients = self.fore.get_forecast_clients()
+        self.extracts.update(client=(harvest_clients, forecast_clients))
+
+    def extract_task(self):
+        harvest_tasks = self.harv.get_harvest_tasks(updated_since=self.task_last_updated)
+        self.extracts.update(task=harvest_tasks)
+
+    def extract_project(self):
+        harvest_projects = self.harv.get_harvest_projects(updated_since=self.project_last_updated)
+        forecast_projects = self.fore.get_forecast_projects()
+        self.extracts.update(project=(harvest_projects, forecast_projects))
+
+    def extract_assignment(self):
+        assignments = self.fore.get_forecast_assignments()
+        self.extracts.update(assignment=assignments)
 
     """
     Munge Functions
@@ -33,6 +75,7 @@ class UberMunge(object):
     All these functions take in data, transform as needed, and push to the db
     """
 
+    @metrics.timed
     @db_session
     def munge_person(self):
         """Get all Harvest and Forecast people, combine, transform, and push them to db
@@ -42,9 +85,8 @@ class UberMunge(object):
         """
         # Get Harvest and Forecast people
         updated_since = self.person_last_updated
-        harvest_people = self.harv.get_harvest_users(updated_since=updated_since)
+        harvest_people, forecast_people = self.__take_extract__('person')
         harvest_people_list = harvest_people['users']
-        forecast_people = self.fore.get_forecast_people()
         forecast_people_list = forecast_people['people']
         # Trim the Forecast list to the updated_date
         forecast_people_list = self.__trim_forecast_results__(f_result_set=forecast_people_list,
@@ -61,14 +103,11 @@ class UberMunge(object):
             # Replace the roles key with primary role
             self.__set_primary_role__(h_person)
 
-            # Try to find a Forecast id in the newly pulled list
-            for idx, f_person in enumerate(forecast_people_list):
-                if h_person['harvest_id'] == f_person['harvest_id']:
-                    h_person.update(forecast_id=f_person['id'])
-                    forecast_people_list.pop(idx)
-                else:
-                    pass
+        # Try to find a Forecast id in the newly pulled list, what's left over is handled after the Harvest people
+        forecast_people_list = self.__match_forecast_results__(h_result_set=harvest_people_list,
+                                                               f_result_set=forecast_people_list)
 
+        for h_person in harvest_people_list:
             # Also see if the person has a Forecast ID in the db if the person still doesn't have a Forecast ID
             if 'forecast_id' not in h_person.keys():
                 try:
@@ -82,7 +121,7 @@ class UberMunge(object):
 
         # For each Person record, check if in db and then insert/update accordingly
         print('Writing People:')
-        logger.print_progress_bar(iteration=0, total=len(harvest_people_list))
+        progress = logger.progress(total=len(harvest_people_list), prefix='People')
         for idx, person in enumerate(harvest_people_list):
             harvest_id = person['harvest_id']
             full_name = "{fn} {ln}".format(fn=person['first_name'], ln=person['last_name'])
@@ -93,8 +132,10 @@ class UberMunge(object):
                 p = Person.get(harvest_id=harvest_id)
                 if p:
                     p.set(**person)
+                    metrics.count('rows_updated')
                 else:
-                    np = Person(harvest_id=harvest_id,
+                    metrics.count('rows_inserted')
+                    p = Person(harvest_id=harvest_id,
                                 forecast_id=person['forecast_id'],
                                 first_name=person['first_name'],
                                 last_name=person['last_name'],
@@ -110,14 +151,17 @@ class UberMunge(object):
                                 updated_at=person['updated_at'])
                 # Commit the record
                 db.commit()
+                self.id_cache.add(p)
+                self.__raise_high_water__('person', person['updated_at'])
             except Exception as e:
-                desc = "Person Entry Error - id: {}".format(person['harvest_id'])
-                logger.write_load_completion(documents=str(e), description=desc)
-            # Update the on-screen progress bar
-            logger.print_progress_bar(iteration=idx + 1, total=len(harvest_people_list))
+                logger.record_error(description="Person Entry Error", record_id=person['harvest_id'], error=e)
+            # Report progress, throttled so it can be called for every record
+            progress.update(idx + 1)
 
         # Cycle through remaining Forecast people to update forecast_id, if needed
         for f_person in forecast_people_list:
+            # Cleared each time, so a failed lookup never re-adds the previous person to the id cache
+            p = None
             f_person.update(forecast_id=f_person.pop('id'))
             full_name = "{fn} {ln}".format(fn=f_person['first_name'], ln=f_person['last_name'])
             is_active = not f_person.pop('archived')
@@ -130,23 +174,31 @@ class UberMunge(object):
             else:
                 # If orphan Person exists, update. Else, insert.
                 try:
-                    fp = Person.get(forecast_id=f_person['forecast_id'])
-                    if fp:
-                        fp.set(**f_person)
+                    p = Person.get(forecast_id=f_person['forecast_id'])
+                    if p:
+                        p.set(**f_person)
+                        metrics.count('rows_updated')
                     else:
-                        nfp = Person(forecast_id=f_person['forecast_id'],
+                        metrics.count('rows_inserted')
+                        p = Person(forecast_id=f_person['forecast_id'],
                                      first_name=f_person['first_name'],
                                      last_name=f_person['last_name'],
                                      full_name=full_name,
                                      email=f_person['email'],
                                      is_active=f_person['is_active'],
                                      updated_at=f_person['updated_at'])
+                    self.__raise_high_water__('person', f_person['updated_at'])
                 except Exception as e:
-                    desc = "Forecast Person Entry Error - id: {}".format(f_person['forecast_id'])
-                    logger.write_load_completion(documents=str(e), description=desc)
+                    logger.record_error(description="Forecast Person Entry Error",
+                                        record_id=f_person['forecast_id'], error=e)
             # Commit the records
             db.commit()
+            if p:
+                self.id_cache.add(p)
 
+        self.__save_high_water__('person')
+
+    @metrics.timed
     @db_session
     def munge_client(self):
         """Pulls Harvest and Forecast Clients and inserts/updates records
@@ -154,9 +206,8 @@ class UberMunge(object):
         :return:
         """
         updated_since = self.client_last_updated
-        harvest_clients = self.harv.get_harvest_clients(updated_since=updated_since)
+        harvest_clients, forecast_clients = self.__take_extract__('client')
         harvest_client_list = harvest_clients['clients']
-        forecast_clients = self.fore.get_forecast_clients()
         forecast_clients_list = forecast_clients['clients']
         # Trim Forecast list based on updated_since var
         forecast_clients_list = self.__trim_forecast_results__(f_result_set=forecast_clients_list,
@@ -170,16 +221,12 @@ class UberMunge(object):
             h_client.update(created_at=datetime.strptime(h_client['created_at'], datetime_format))
             h_client.update(updated_at=datetime.strptime(h_client['updated_at'], datetime_format))
 
-            for idx, f_client in enumerate(forecast_clients_list):
-                if h_client['harvest_id'] == f_client['harvest_id']:
-                    h_client.update(forecast_id=f_client['id'])
-                    forecast_clients_list.pop(idx)
-                else:
-                    pass
+        forecast_clients_list = self.__match_forecast_results__(h_result_set=harvest_client_list,
+                                                                f_result_set=forecast_clients_list)
 
         # For each Client record, check if in db and update/insert accordingly
         print('Writing Clients')
-        logger.print_progress_bar(iteration=0, total=len(harvest_client_list))
+        progress = logger.progress(total=len(harvest_client_list), prefix='Clients')
         for idx, client in enumerate(harvest_client_list):
             harvest_id = client['harvest_id']
 
@@ -188,8 +235,10 @@ class UberMunge(object):
                 c = Client.get(harvest_id=harvest_id)
                 if c:
                     c.set(**client)
+                    metrics.count('rows_updated')
                 else:
-                    nc = Client(harvest_id=harvest_id,
+                    metrics.count('rows_inserted')
+                    c = Client(harvest_id=harvest_id,
                                 forecast_id=client['forecast_id'],
                                 name=client['name'],
                                 is_active=client['is_active'],
@@ -197,15 +246,18 @@ class UberMunge(object):
                                 updated_at=client['updated_at'])
                 # Commit the record
                 db.commit()
+                self.id_cache.add(c)
+                self.__raise_high_water__('client', client['updated_at'])
             except Exception as e:
-                desc = "Client Entry Error - id: {}".format(client['harvest_id'])
-                logger.write_load_completion(documents=str(e), description=desc)
+                logger.record_error(description="Client Entry Error", record_id=client['harvest_id'], error=e)
 
-            # Update the on-screen progress bar
-            logger.print_progress_bar(iteration=idx + 1, total=len(harvest_client_list))
+            # Report progress, throttled so it can be called for every record
+            progress.update(idx + 1)
 
         # Cycle through remaining Forecast clients to update forecast_id, if needed
         for f_client in forecast_clients_list:
+            # Cleared each time, so a failed lookup never re-adds the previous client to the id cache
+            c = None
             is_active = not f_client.pop('archived')
             f_client.update(is_active=is_active)
             f_client.update(forecast_id=f_client.pop('id'))
@@ -216,19 +268,29 @@ class UberMunge(object):
                 c.forecast_id = f_client['forecast_id']
             else:
                 try:
-                    fc =Client.get(forecast_id=f_client['forecast_id'])
+                    c = Client.get(forecast_id=f_client['forecast_id'])
                     # Update or insert the orphan Forecast client
-                    if fc:
-                        fc.set(**f_client)
+                    if c:
+                        c.set(**f_client)
+                        metrics.count('rows_updated')
                     else:
-                        nfc = Client(forecast_id=f_client['forecast_id'],
+                        metrics.count('rows_inserted')
+                        c = Client(forecast_id=f_client['forecast_id'],
                                 name=f_client['name'],
                                 is_active=f_client['is_active'],
                                 updated_at=f_client['updated_at'])
-                except:
-                    desc = "Forecast Client Entry Error - id: {}".format(f_client['forecast_id'])
-                    logger.write_load_completion(documents=str(e), description=desc)
+                    self.__raise_high_water__('client', f_client['updated_at'])
+                except Exception as e:
+                    logger.record_error(description="Forecast Client Entry Error",
+                                        record_id=f_client['forecast_id'], error=e)
+            # Commit the records
+            db.commit()
+            if c:
+                self.id_cache.add(c)
+
+        self.__save_high_water__('client')
 
+    @metrics.timed
     @db_session
     def munge_task(self):
         """Get all Harvest Tasks and send them to the db.
@@ -236,13 +298,12 @@ class UberMunge(object):
         :return:
         None
         """
-        updated_since = self.task_last_updated
         # Get the Harvest Tasks List from its API
-        harvest_tasks = self.harv.get_harvest_tasks(updated_since=updated_since)
+        harvest_tasks = self.__take_extract__('task')
         harvest_tasks_list = harvest_tasks['tasks']
 
         print('Writing Tasks')
-        logger.print_progress_bar(iteration=0, total=len(harvest_tasks_list))
+        progress = logger.progress(total=len(harvest_tasks_list), prefix='Tasks')
         for idx, task in enumerate(harvest_tasks_list):
             t_id = task['id']
             dt_updated_at = datetime.strptime(task['updated_at'], datetime_format)
@@ -252,25 +313,29 @@ class UberMunge(object):
             try:
                 if Task.get(id=t_id):
                     Task[t_id].set(**task)
+                    metrics.count('rows_updated')
                 else:
+                    metrics.count('rows_inserted')
                     t = Task(id=task['id'], name=task['name'], updated_at=task['updated_at'])
                 # Commit the record to the db
                 db.commit()
+                self.__raise_high_water__('task', task['updated_at'])
             except Exception as e:
-                desc = "Task Entry Error - id: {}".format(task['id'])
-                logger.write_load_completion(documents=str(e), description=desc)
-            # Update the on-screen progress bar
-            logger.print_progress_bar(iteration=idx + 1, total=len(harvest_tasks_list))
+                logger.record_error(description="Task Entry Error", record_id=task['id'], error=e)
+            # Report progress, throttled so it can be called for every record
+            progress.update(idx + 1)
 
+        self.__save_high_water__('task')
+
+    @metrics.timed
     @db_session
     def munge_project(self):
         """Pulls Harvest and Forecast projects and inserts/updates records
 
         """
         updated_since = self.project_last_updated
-        harvest_projects = self.harv.get_harvest_projects(updated_since=updated_since)
+        harvest_projects, forecast_projects = self.__take_extract__('project')
         harvest_projects_list = harvest_projects['projects']
-        forecast_projects = self.fore.get_forecast_projects()
         forecast_projects_list = forecast_projects['projects']
         # Trim Forecast list based on updated_since var
         forecast_projects_list = self.__trim_forecast_results__(f_result_set=forecast_projects_list,
@@ -290,20 +355,15 @@ class UberMunge(object):
                 h_proj.update(ends_on=datetime.strptime(h_proj['ends_on'], date_format))
 
             # Get Data Warehouse id for Client
-            dw_client = get_client_by_id(identifier=h_proj['client_id'])
-            h_proj.update(client_id=dw_client.id)
-
-            # Get Forecast id
-            for idx, f_proj in enumerate(forecast_projects_list):
-                if h_proj['harvest_id'] == f_proj['harvest_id']:
-                    h_proj.update(forecast_id=f_proj['id'])
-                    forecast_projects_list.pop(idx)
-                else:
-                    pass
+            h_proj.update(client_id=self.id_cache.resolve(Client, h_proj['client_id']))
+
+        # Get Forecast id
+        forecast_projects_list = self.__match_forecast_results__(h_result_set=harvest_projects_list,
+                                                                 f_result_set=forecast_projects_list)
 
         # For each Project record, check if in db and update/insert accordingly
         print('Writing Projects')
-        logger.print_progress_bar(iteration=0, total=len(harvest_projects_list))
+        progress = logger.progress(total=len(harvest_projects_list), prefix='Projects')
         for idx, proj in enumerate(harvest_projects_list):
             harvest_id = proj['harvest_id']
 
@@ -312,8 +372,10 @@ class UberMunge(object):
                 pr = Project.get(harvest_id=harvest_id)
                 if pr:
                     pr.set(**proj)
+                    metrics.count('rows_updated')
                 else:
-                    npr = Project(harvest_id=proj['harvest_id'],
+                    metrics.count('rows_inserted')
+                    pr = Project(harvest_id=proj['harvest_id'],
                                   forecast_id=proj['forecast_id'],
                                   name=proj['name'],
                                   code=proj['code'],
@@ -328,14 +390,17 @@ class UberMunge(object):
                                   starts_on=proj['starts_on'],
                                   ends_on=proj['ends_on'],)
                 db.commit()
+                self.id_cache.add(pr)
+                self.__raise_high_water__('project', proj['updated_at'])
             except Exception as e:
-                desc = "Project Entry Error - id: {}".format(proj['harvest_id'])
-                logger.write_load_completion(documents=str(e), description=desc)
-            #Update on-screen progress bar
-            logger.print_progress_bar(iteration=idx + 1, total=len(harvest_projects_list))
+                logger.record_error(description="Project Entry Error", record_id=proj['harvest_id'], error=e)
+            # Report progress, throttled so it can be called for every record
+            progress.update(idx + 1)
 
         # Cycle through remaining Forecast Projects to update records
         for f_proj in forecast_projects_list:
+            # Cleared each time, so a failed lookup never re-adds the previous project to the id cache
+            pr = None
             f_proj.update(forecast_id=f_proj.pop('id'))
             f_proj.update(updated_at=datetime.strptime(f_proj['updated_at'], datetime_format_ms))
             if f_proj['starts_on']:
@@ -354,20 +419,22 @@ class UberMunge(object):
 
                 # Check for a client ID. If no result is returned, set client to RevUnit
                 if f_proj['client_id']:
-                    dw_client = get_client_by_id(f_proj['client_id'])
-                    f_proj.update(client_id=dw_client.id)
-                    f_proj.update(client_name=dw_client.name)
+                    dw_client_id = self.id_cache.resolve(Client, f_proj['client_id'])
+                    f_proj.update(client_id=dw_client_id)
+                    f_proj.update(client_name=Client[dw_client_id].name)
                 else:
                     f_proj.update(client_id=164)
                     f_proj.update(client_name='RevUnit')
 
                 # Update or insert the orphan Forecast client
                 try:
-                    fpr = Project.get(forecast_id=f_proj['forecast_id'])
-                    if fpr:
-                        fpr.set(**f_proj)
+                    pr = Project.get(forecast_id=f_proj['forecast_id'])
+                    if pr:
+                        pr.set(**f_proj)
+                        metrics.count('rows_updated')
                     else:
-                        nfpr = Project(forecast_id=f_proj['forecast_id'],
+                        metrics.count('rows_inserted')
+                        pr = Project(forecast_id=f_proj['forecast_id'],
                                        name=f_proj['name'],
                                        code=f_proj['code'],
                                        client_id=f_proj['client_id'],
@@ -376,28 +443,70 @@ class UberMunge(object):
                                        updated_at=f_proj['updated_at'],
                                        starts_on=f_proj['starts_on'],
                                        ends_on=f_proj['ends_on'],)
+                    self.__raise_high_water__('project', f_proj['updated_at'])
                 except Exception as e:
-                    desc = "Forecast Project Entry Error - id: {}".format(f_proj['forecast_id'])
-                    logger.write_load_completion(documents=str(e), description=desc)
+                    logger.record_error(description="Forecast Project Entry Error",
+                                        record_id=f_proj['forecast_id'], error=e)
             db.commit()
+            if pr:
+                self.id_cache.add(pr)
 
-    @db_session
+        self.__save_high_water__('project')
+
+    @metrics.timed
     def munge_time_entries(self):
         """Pulls Time Entries for a given range and sends them to the data warehouse
 
+        Entries are streamed from Harvest page by page and written in batches of LOAD_BATCH_SIZE, each batch in its
+        own db_session and merged with a single bulk upsert, so memory use stays flat no matter how much history the
+        load covers. On a diff load each batch is also upserted into the legacy harvest_entries table.
+
+        With a snapshot the pull reaches back to its time_entry_window too, if that's earlier, so the time entry sync
+        can use it instead of pulling again. Entries older than the watermark are only recorded, not written.
         """
         last_updated = self.time_entry_last_updated
-        entries = self.harv.get_harvest_time_entries(updated_since=last_updated)
-        entries_list = entries['time_entries']
-        # Get stats for console progress bar
-        total_entries = len(entries_list)
+        window = self.snapshot.time_entry_window if self.snapshot is not None else None
+        if window is None or last_updated is None or last_updated <= window:
+            pull_since = last_updated
+        else:
+            pull_since = window
+        entries = self.harv.iter_harvest_time_entries(updated_since=pull_since)
+        if window is not None:
+            entries = self.__share_time_entries__(entries=entries, window=window, write_since=last_updated)
+
+        print("Writing Time Entries")
+        total_entries = 0
+        for entries_chunk in chunked(entries, load_batch_size):
+            self.__write_time_entries__(entries_list=entries_chunk)
+            total_entries += len(entries_chunk)
+        print("Wrote {} Time Entries".format(total_entries))
+        self.__save_high_water__('time_entry')
+
+        # A full load rebuilds the legacy entries table, diff loads kept it current batch by batch
+        if self.is_full_load:
+            print("Copying records to legacy entries table")
+            trunc_legacy_entries()
+            copy_to_legacy_entries()
+
+    def __share_time_entries__(self, entries, window, write_since):
+        """Passes on the entries to write and records the ids of those in the window once the pull is done"""
+        window_ids = []
+        for entry in entries:
+            if entry['updated_at'] >= window:
+                window_ids.append(entry['id'])
+            if write_since is None or entry['updated_at'] >= write_since:
+                yield entry
+        self.snapshot.record_time_entries(since=window, ids=window_ids)
+
+    @db_session
+    def __write_time_entries__(self, entries_list):
+        """Transforms one batch of Harvest time entries and inserts/updates them in the data warehouse"""
         rounder = lambda x: round(x*4)/4
+        load_list = []
 
-        print("Writing Time Entries ({} total)".format(total_entries))
-        logger.print_progress_bar(iteration=0, total=total_entries)
-        for idx, entry in enumerate(entries_list):
-            # Convert dates to ORM friendly Python objects
-            entry.update(spent_date=datetime.strptime(entry['spent_date'], date_format))
+        for entry in entries_list:
+            # Convert dates to db friendly Python objects
+            entry.update(spent_date=datetime.strptime(entry['spent_date'], date_format).date())
             entry.update(created_at=datetime.strptime(entry['created_at'], datetime_format))
             entry.update(updated_at=datetime.strptime(entry['updated_at'], datetime_format))
 
@@ -415,51 +524,33 @@ class UberMunge(object):
                 entry.update(entry_amount=0)
 
             # Update person, project, and client fk's to match data warehouse
-            p = get_person_by_id(entry['person_id'])
-            entry.update(person_id=p.id)
-            pr = get_project_by_id(entry['project_id'])
-            entry.update(project_id=pr.id)
-            c = get_client_by_id(entry['client_id'])
-            entry.update(client_id=c.id)
-
-            try:
-                # If entry exists, update.  Else write new entry
-                te = Time_Entry.get(id=entry['id'])
-                if te:
-                    te.set(**entry)
-                else:
-                # Write the new time entry
-                    nte = Time_Entry(id=entry['id'],
-                                    spent_date=entry['spent_date'],
-                                    hours=entry['hours'],
-                                    billable=entry['billable'],
-                                    billable_rate=entry['billable_rate'],
-                                    created_at=entry['created_at'],
-                                    updated_at=entry['updated_at'],
-                                    entry_amount=entry['entry_amount'],
-                                    person_id=entry['person_id'],
-                                    person_name=entry['person_name'],
-                                    project_id=entry['project_id'],
-                                    project_name=entry['project_name'],
-                                    project_code=entry['project_code'],
-                                    client_id=entry['client_id'],
-                                    client_name=entry['client_name'],
-                                    task_id=entry['task_id'],
-                                    task_name=entry['task_name'])
-            except Exception as e:
-                desc = "Time Entry Error - id: {}".format(entry['id'])
-                logger.write_load_completion(documents=str(e), description=desc)
-
-            # Commit entries
-            db.commit()
-            logger.print_progress_bar(iteration=idx + 1, total=total_entries)
-
-        # Trunc legacy entries table and copy time_entry values to it
-        print("Copying records to legacy entries table")
-        trunc_legacy_entries()
-        copy_to_legacy_entries()
-
-    @db_session
+            entry.update(person_id=self.id_cache.resolve(Person, entry['person_id']))
+            entry.update(project_id=self.id_cache.resolve(Project, entry['project_id']))
+            entry.update(client_id=self.id_cache.resolve(Client, entry['client_id']))
+            if None in (entry['person_id'], entry['project_id'], entry['client_id']):
+                logger.record_error(description="Time Entry Error", record_id=entry['id'],
+                                    error='No data warehouse record for a person, project or client',
+                                    error_type='MissingForeignKey')
+                continue
+
+            load_list.append(entry)
+
+        # Insert new and update existing entries in one merge, only the rows that fail are left out
+        failed_rows = upsert_time_entries(time_entry_list=load_list)
+        metrics.count('rows_upserted', len(load_list) - len(failed_rows))
+        for entry_id, error in failed_rows:
+            logger.record_error(description="Time Entry Error", record_id=entry_id, error=error)
+
+        failed_ids = {entry_id for entry_id, error in failed_rows}
+        written = [entry for entry in load_list if entry['id'] not in failed_ids]
+        if written:
+            self.__raise_high_water__('time_entry', max(entry['updated_at'] for entry in written))
+
+        # Keep the legacy table in step with just the entries written in this batch
+        if not self.is_full_load:
+            upsert_legacy_entries(entry_ids=[entry['id'] for entry in written])
+
+    @metrics.timed
     def munge_assignment(self):
         """Converts Forecast API into data warehouse friendly data
 
@@ -467,8 +558,9 @@ class UberMunge(object):
         Takes the date range from the Forecast entry and splits it into individual business day entries
         Calculates the hours/day for each assignment (source shows in seconds)
         Replaces API identity values with data warehouse ones
+        Parents are worked in batches of LOAD_BATCH_SIZE, each expanded and inserted in one go
         """
-        assignments = self.fore.get_forecast_assignments()
+        assignments = self.__take_extract__('assignment')
         assignments_list = assignments['assignments']
 
         # Trim Assignments list by updated date
@@ -479,63 +571,61 @@ class UberMunge(object):
         total_parent_assns = len(assignments_list)
 
         print("Writing Assignments ({} Parent Assignments)".format(total_parent_assns))
-        logger.print_progress_bar(iteration=0, total=total_parent_assns)
-        for idx, assn in enumerate(assignments_list):
-            # Grab information for split entries
-            id = assn.pop('id')
-            start_date = assn.pop('start_date')
-            end_date = assn.pop('end_date')
-            updated_at = assn.pop('updated_at')
-            updated_at = datetime.strptime(updated_at, datetime_format_ms)
-
-            # Convert Allocation to hours from seconds
-            allocation = assn.pop('allocation')/3600
+        progress = logger.progress(total=total_parent_assns, prefix='Assignments')
+        parents_done = 0
+        for assns_chunk in chunked(assignments_list, load_batch_size):
+            self.__write_assignments__(assignments_list=assns_chunk)
+            parents_done += len(assns_chunk)
+            # Report progress, throttled so it can be called for every record
+            progress.update(parents_done)
 
-            # Update Assignment Project and Person fk's to match Data Warehouse
-            pr = get_project_by_id(assn['project_id'])
-            assn.update(project_id=pr.id)
+        self.__save_high_water__('time_assignment')
 
-            # Check if record has person id, if it does prepare data for next step
-            if assn['person_id']:
-                p = get_person_by_id(assn['person_id'])
-                assn.update(person_id=p.id)
-                # Generate date list between start/end of assignment
-                dates = self.__make_date_list__(start=start_date, end=end_date)
-            else:
-                # Make dates an empty list so it does not write the split assignments to the db
-                dates = []
-
-            # Check if assignment records exist already with our parent id, delete if so
-            a_recs = get_assignments_by_parent(parent_id=id)
-            for rec in a_recs:
-                Time_Assignment[rec.id].delete()
-            db.commit()
+    @db_session
+    def __write_assignments__(self, assignments_list):
+        """Replaces the split day entries for one batch of Forecast parent assignments
 
-            # For each business day in the assignment, make a new split entry
-            for day in dates:
-                if is_busday(day):
-                    split_assn = assn.copy()
-                    split_assn.update(parent_id=id)
-                    split_assn.update(assign_date=(day).strftime(date_format))
-                    split_assn.update(allocation=allocation)
-
-                    # Insert the Time Assignment record
-                    try:
-                        ta = Time_Assignment(parent_id=id,
-                                             person_id=assn['person_id'],
-                                             project_id=assn['project_id'],
-                                             assign_date=day,
-                                             allocation=allocation,
-                                             updated_at=updated_at)
-                        db.commit()
-                    except Exception as e:
-                        desc = "Time Assignment Error - id: {}".format(assn['id'])
-                        logger.write_load_completion(documents=str(e), description=desc)
+        The old day rows of every parent in the batch are deleted and the new ones inserted in a single transaction, so
+        a failed batch leaves its previous rows in place.
+        """
+        parents = []
+        for assn in assignments_list:
+            # Update Assignment Project and Person fk's to match Data Warehouse
+            parent = {'parent_id': assn['id'],
+                      'start_date': assn['start_date'],
+                      'end_date': assn['end_date'],
+                      'updated_at': datetime.strptime(assn['updated_at'], datetime_format_ms),
+                      # Convert Allocation to hours from seconds
+                      'allocation': assn['allocation']/3600,
+                      'project_id': self.id_cache.resolve(Project, assn['project_id']),
+                      'person_id': None}
+
+            # Only assignments with a person get split entries written to the db
+            if assn['person_id']:
+                parent.update(person_id=self.id_cache.resolve(Person, assn['person_id']))
+                if None in (parent['person_id'], parent['project_id']):
+                    logger.record_error(description="Time Assignment Error", record_id=parent['parent_id'],
+                                        error='No data warehouse record for the person or project',
+                                        error_type='MissingForeignKey')
                 else:
-                    pass
-
-            # Update the on-screen progress bar
-            logger.print_progress_bar(iteration=idx + 1, total=total_parent_assns)
+                    parents.append(parent)
+
+        # Split every parent into its business days, then swap them in for every parent's existing rows at once.
+        # Parents without a person only have their old rows removed.
+        day_block = self.__expand_business_days__(parents=parents)
+        try:
+            deleted_count = replace_time_assignments(parent_ids=[assn['id'] for assn in assignments_list],
+                                                     assignment_block=day_block)
+            db.commit()
+            metrics.count('rows_deleted', deleted_count)
+            metrics.count('rows_inserted', len(day_block['parent_id']))
+            # Forecast's timestamp strings sort in date order, so only the newest one needs parsing
+            newest = max(assn['updated_at'] for assn in assignments_list)
+            self.__raise_high_water__('time_assignment', datetime.strptime(newest, datetime_format_ms))
+        except Exception as e:
+            db.rollback()
+            parent_ids = [assn['id'] for assn in assignments_list]
+            logger.record_error(description="Time Assignment Error", record_id=parent_ids, error=e)
 
     """
     Utility Methods
@@ -547,27 +637,41 @@ class UberMunge(object):
 
         When the "full_load" param is True, a date from 2010 is passed to ensure all records are returned, with the
         exception of Time Entries, which will use the system variable FROM_DATE since the payload from that is so large
-        Otherwise a set of dates determined by the max updated_at field in the data warehouse are returned for each
-        table.
-
-        ToDos:
-            -Split this into methods that returns results for individual tables rather than all tables at once to avoid
-             errors if there are no records in a table.
+        Otherwise each table's watermark from the load_watermark table is used, read in one query. A table that has
+        never been loaded gets the full load date.
         """
+        self.is_full_load = is_full_load
         if is_full_load:
-            self.person_last_updated = full_load_datetime
-            self.project_last_updated = full_load_datetime
-            self.client_last_updated = full_load_datetime
-            self.task_last_updated = full_load_datetime
-            self.assn_last_updated = full_load_datetime
-            self.time_entry_last_updated = conf['FROM_DATE']
+            last_updated_dict = {}
         else:
-            self.person_last_updated = self.last_updated_dict['person'].strftime(datetime_format)
-            self.project_last_updated = self.last_updated_dict['project'].strftime(datetime_format)
-            self.client_last_updated = self.last_updated_dict['client'].strftime(datetime_format)
-            self.task_last_updated = self.last_updated_dict['task'].strftime(datetime_format)
-            self.assn_last_updated = self.last_updated_dict['time_assignment'].strftime(datetime_format)
-            self.time_entry_last_updated = self.last_updated_dict['time_entry'].strftime(datetime_format)
+            last_updated_dict = get_updated_from_dates()
+
+        def last_updated(name, default=full_load_datetime):
+            high_water = last_updated_dict.get(name)
+            return high_water.strftime(datetime_format) if high_water else default
+
+        self.person_last_updated = last_updated('person')
+        self.project_last_updated = last_updated('project')
+        self.client_last_updated = last_updated('client')
+        self.task_last_updated = last_updated('task')
+        self.assn_last_updated = last_updated('time_assignment')
+        self.time_entry_last_updated = last_updated('time_entry', default=conf['FROM_DATE'])
+
+    def __raise_high_water__(self, name, updated_at):
+        """Notes the updated_at of a record written to a table, keeping the newest"""
+        if updated_at and (name not in self.high_water or updated_at > self.high_water[name]):
+            self.high_water.update({name: updated_at})
+
+    def __save_high_water__(self, name):
+        """Saves the newest updated_at written to a table as its watermark, called once its munge_ method is done"""
+        if name in self.high_water:
+            set_watermark(name=name, high_water=self.high_water.pop(name))
+
+    def __take_extract__(self, table):
+        """Hands back the source data pulled by extract_<table>, running the extract first if it hasn't been"""
+        if table not in self.extracts:
+            getattr(self, 'extract_' + table)()
+        return self.extracts.pop(table)
 
     def __set_primary_role__(self, harvest_person):
         """Takes in a single person entry from Harvest api and replaces rows list with a single primary role.
@@ -611,10 +715,49 @@ class UberMunge(object):
 
         return filter_list
 
-    def __make_date_list__(self, start, end):
-        # This takes two dates and provides the dates between them, inclusive of start and end
-        start_date = datetime.strptime(start, date_format)
-        end_date = datetime.strptime(end, date_format)
-        dates = [start_date + timedelta(days=x) for x in range((end_date - start_date).days + 1)]
+    def __match_forecast_results__(self, h_result_set, f_result_set):
+        """Sets forecast_id on each Harvest record that has a Forecast record with its harvest_id
+
+        The Forecast records are indexed by harvest_id once, so each Harvest record is matched with a dict lookup
+        rather than a scan of the Forecast list. If Forecast has several records for one harvest_id the first is used.
+
+        :returns list of the Forecast records that matched no Harvest record, in their original order
+        """
+        f_by_harvest_id = {}
+        for f_obj in f_result_set:
+            if f_obj['harvest_id'] is not None:
+                f_by_harvest_id.setdefault(f_obj['harvest_id'], f_obj)
+
+        matched_ids = set()
+        for h_obj in h_result_set:
+            f_obj = f_by_harvest_id.get(h_obj['harvest_id'])
+            if f_obj is not None:
+                h_obj.update(forecast_id=f_obj['id'])
+                matched_ids.add(f_obj['id'])
+
+        return [f_obj for f_obj in f_result_set if f_obj['id'] not in matched_ids]
+
+    def __expand_business_days__(self, parents):
+        """Splits each parent assignment into one row per business day from its start to end date (inclusive)
+
+        Works on the whole batch at once with NumPy busday arithmetic over datetime64 arrays instead of checking every
+        calendar day of every assignment in a Python loop.
+
+        :param parents: list of dicts with parent_id, person_id, project_id, start_date, end_date, allocation, updated_at
+        :return: dict of equal length NumPy arrays, one per time_assignment column
+        """
+        starts = np.array([parent['start_date'] for parent in parents], dtype='datetime64[D]')
+        ends = np.array([parent['end_date'] for parent in parents], dtype='datetime64[D]')
+
+        # busday_count leaves out the end date, so count up to the day after it
+        day_counts = np.maximum(np.busday_count(starts, ends + 1), 0)
+        # Which parent each day row belongs to, and how many business days into the parent it falls
+        parent_idx = np.repeat(np.arange(len(parents)), day_counts)
+        day_offsets = np.arange(day_counts.sum()) - np.repeat(np.cumsum(day_counts) - day_counts, day_counts)
+
+        assignment_block = {'assign_date': np.busday_offset(starts[parent_idx], day_offsets, roll='forward')}
+        for column in ['parent_id', 'person_id', 'project_id', 'allocation', 'updated_at']:
+            column_values = np.array([parent[column] for parent in parents], dtype=object)
+            assignment_block[column] = column_values[parent_idx]
 
-        return dates
\ No newline at end of file
+        return assignment_block
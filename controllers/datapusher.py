@@ -1,19 +1,118 @@
 ### Purpose of file: This is the controller that will perform file data gathering and push to the db ###
 
 ## Imports
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
 from controllers.datamunger import UberMunge
 from controllers.datacleanser import GarbageCollector
-from controllers.utilitybot import logger
+from controllers.dataarchiver import ResponseArchive, ArchivingSession, ReplaySession
+from controllers.datagrabber import SourceSnapshot, SnapshotSession
+from controllers.utilitybot import logger, metrics, datetime_format
+from data_rocket_conf import config as conf
+
+
+## Variables
+stage_concurrency = int(conf['STAGE_CONCURRENCY'])
 
 
 ##  Classes
 
 
+class Stage(object):
+    """One step of a load: a name, the function that does the work, and the names of the stages it has to wait for"""
+    def __init__(self, name, action, depends_on=()):
+        self.name = name
+        self.action = action
+        self.depends_on = list(depends_on)
+
+
+class StageRunner(object):
+    """Runs a set of Stages on a thread pool, starting each one as soon as every stage it depends on has finished
+
+    Dependencies on stages that aren't part of this run count as already met, so a partial load (say only
+    time_entries) doesn't wait on tables it isn't loading.
+    """
+    def __init__(self, max_workers=stage_concurrency):
+        self.max_workers = max(int(max_workers), 1)
+        self.stage_times = {}
+
+    def run(self, stages):
+        """Runs the stages and returns a dict of stage name: wall time in seconds
+
+        If a stage fails no new stages are started, the running ones are allowed to finish, and the error is raised.
+        """
+        stage_names = {stage.name for stage in stages}
+        pending = list(stages)
+        finished = set()
+        running = {}
+        error = None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while (pending and error is None) or running:
+                if error is None:
+                    ready = [stage for stage in pending
+                             if all(dep in finished or dep not in stage_names for dep in stage.depends_on)]
+                    for stage in ready:
+                        pending.remove(stage)
+                        running[executor.submit(self.__time_stage__, stage)] = stage
+
+                if not running:
+                    raise ValueError('Stages {} depend on each other and can never start'.format(
+                        [stage.name for stage in pending]))
+
+                done, not_done = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        future.result()
+                        finished.add(stage.name)
+                    except Exception as e:
+                        print('Stage {name} failed because {e}'.format(name=stage.name, e=e))
+                        error = error or e
+
+        self.__print_stage_times__()
+        if error is not None:
+            raise error
+        return self.stage_times
+
+    def __time_stage__(self, stage):
+        start = datetime.now()
+        try:
+            # Also lands in the run's load metrics, prefixed so it can't collide with the function it wraps
+            with metrics.stage('stage_' + stage.name):
+                stage.action()
+        finally:
+            self.stage_times.update({stage.name: (datetime.now() - start).total_seconds()})
+
+    def __print_stage_times__(self):
+        print('Stage wall times:')
+        for name, seconds in sorted(self.stage_times.items(), key=lambda item: item[1], reverse=True):
+            print('  {name}: {s:.1f}s'.format(name=name, s=seconds))
+
+
 class PusherBot(object):
     # This class handles collating and pushing clean data to the DB
-    gc = GarbageCollector()
-    def __init__(self, is_test=False):
+    def __init__(self, is_test=False, archive=False, replay=False):
+        """
+        archive saves every raw API response of the run to ARCHIVE_DIR, replay answers every request from an archived
+        run (REPLAY_RUN, or the latest) instead of the APIs. Replay wins if both are set.
+        """
         self.uber = UberMunge(is_test=is_test)
+        self.gc = GarbageCollector()
+        self.archive = None
+        if not is_test:
+            # One Harvester and Forecaster for both, so each load's SourceSnapshot sits in front of every pull
+            self.gc.harv, self.gc.fore = self.uber.harv, self.uber.fore
+
+        if replay:
+            self.archive = ResponseArchive.for_replay()
+            print('Replaying API responses archived in {}'.format(self.archive.path))
+            self.__route_sessions__(lambda session, source: ReplaySession(archive=self.archive, source=source))
+        elif archive:
+            self.archive = ResponseArchive()
+            print('Archiving API responses to {}'.format(self.archive.path))
+            self.__route_sessions__(lambda session, source: ArchivingSession(session=session, archive=self.archive,
+                                                                             source=source))
 
     def load_data(self, full_load=False, all_tables=False, people=False, clients=False, tasks=False, projects=False,
                   assignments=False, time_entries=False):
@@ -26,28 +125,68 @@ class PusherBot(object):
             self.uber.set_load_dates(is_full_load=False)
 
         """
-        For each flag, check if enabled and then process if true
+        For each flag, check if enabled and add its stages if true.
+        API pulls don't depend on anything and start right away. Each load waits on its pull and on the tables its
+        foreign keys point at, so e.g. people, clients and tasks load side by side while projects wait for clients.
         """
+        stages = []
 
         if people or all_tables:
-            self.uber.munge_person()
+            stages.append(Stage('extract_person', self.uber.extract_person))
+            stages.append(Stage('person', self.uber.munge_person, depends_on=['extract_person']))
 
         if clients or all_tables:
-            self.uber.munge_client()
+            stages.append(Stage('extract_client', self.uber.extract_client))
+            stages.append(Stage('client', self.uber.munge_client, depends_on=['extract_client']))
 
         if tasks or all_tables:
-            self.uber.munge_task()
+            stages.append(Stage('extract_task', self.uber.extract_task))
+            stages.append(Stage('task', self.uber.munge_task, depends_on=['extract_task']))
 
         if projects or all_tables:
-            self.uber.munge_project()
+            stages.append(Stage('extract_project', self.uber.extract_project))
+            stages.append(Stage('project', self.uber.munge_project, depends_on=['extract_project', 'client']))
 
         if assignments or all_tables:
-            self.uber.munge_assignment()
+            stages.append(Stage('extract_assignment', self.uber.extract_assignment))
+            stages.append(Stage('assignment', self.uber.munge_assignment,
+                                depends_on=['extract_assignment', 'person', 'project']))
 
         if time_entries or all_tables:
-            self.uber.munge_time_entries()
+            # Time entries stream straight from the API into the db, so there is no separate pull stage
+            stages.append(Stage('time_entries', self.uber.munge_time_entries,
+                                depends_on=['person', 'project', 'client', 'task']))
 
         # Run cleanup routines on Time Entry and Time Assignments to remove deleted source items from data warehouse
-        self.gc.sync_forecast_assignments()
-        self.gc.sync_harvest_time_entries()
+        stages.append(Stage('sync_assignments', self.gc.sync_forecast_assignments, depends_on=['assignment']))
+        stages.append(Stage('sync_time_entries', self.gc.sync_harvest_time_entries, depends_on=['time_entries']))
 
+        # Everything pulled during this load is shared by its stages. With time entries in the load, their pull also
+        # reaches back far enough for the time entry sync.
+        time_entry_window = None
+        if time_entries or all_tables:
+            time_entry_window = self.gc.time_entry_sync_since().strftime(datetime_format)
+        self.__use_snapshot__(SourceSnapshot(time_entry_window=time_entry_window))
+
+        try:
+            return StageRunner().run(stages)
+        finally:
+            # Let go of the kept responses, the next load pulls fresh
+            self.__use_snapshot__(None)
+            if self.archive is not None:
+                self.archive.close()
+
+    def __use_snapshot__(self, snapshot):
+        """Puts snapshot in front of the grabbers' sessions and hands it to both components, None takes it away"""
+        for grabber in [self.gc.harv, self.gc.fore]:
+            if isinstance(grabber.session, SnapshotSession):
+                grabber.session = grabber.session.session
+            if snapshot is not None:
+                grabber.session = snapshot.session(grabber.session)
+        self.uber.snapshot = snapshot
+        self.gc.snapshot = snapshot
+
+    def __route_sessions__(self, wrap):
+        """Swaps the session of the grabbers this bot uses for wrap(session, source)"""
+        self.gc.harv.session = wrap(self.gc.harv.session, 'harvest')
+        self.gc.fore.session = wrap(self.gc.fore.session, 'forecast')
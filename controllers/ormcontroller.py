@@ -4,6 +4,7 @@ Replaces the dbcontroller.py file from previous versions
 """
 
 from urllib.parse import urlparse
+from io import StringIO
 from data_rocket_conf import config as conf
 from psycopg2.extensions import AsIs
 from controllers.ormobjects import *
@@ -17,7 +18,7 @@ if conf['DB_CONN']:
             host=pg_url.hostname, password=pg_url.password, port=pg_url.port)
 else:
     # If running unit test, use sqlite in memory
-    db.bind(provider='sqlite', filename='unit_test.sqlite', create_db=True)
+    db.bind(provider='sqlite', filename=conf['SQLITE_FILE'], create_db=True)
     print("RUNNING UNIT TESTS ON DB IN MEMORY.  IF THAT IS NOT INTENDED CHECK YOUR CONF FILE")
 
 set_sql_debug(False)
@@ -25,6 +26,26 @@ set_sql_debug(False)
 db.generate_mapping(create_tables=True)
 
 
+"""
+INDEXES
+
+generate_mapping(create_tables=True) also creates any index declared in ormobjects that an existing table is missing,
+so adding an index to ormobjects is enough to migrate it. verify_indexes checks that it happened.
+"""
+
+def secondary_indexes():
+    """Every non-unique index in the mapped schema, the ones declared in ormobjects and Pony's foreign key ones"""
+    return [index for table in db.schema.tables.values() for index in table.indexes.values()
+            if not index.is_pk and not index.is_unique]
+
+
+@db_session
+def verify_indexes():
+    """Names of the secondary indexes missing from the connected database, an empty list if it's up to date"""
+    connection = db.get_connection()
+    return [index.name for index in secondary_indexes() if not index.exists(db.provider, connection)]
+
+
 """
 CREATE:
 The below insert functions each insert data for their namesake.  They assume being passed a list of dictionaries with
@@ -71,6 +92,152 @@ def insert_time_assignment_list(assignment_list):
     print("Errors while inserting assignments: {err} ({p})".format(err=error_count, p=p))
 
 
+# Column order used when bulk loading time entries
+time_entry_columns = ['id', 'spent_date', 'hours', 'billable', 'billable_rate', 'created_at', 'updated_at',
+                      'entry_amount', 'person_id', 'person_name', 'project_id', 'project_name', 'project_code',
+                      'client_id', 'client_name', 'task_id', 'task_name']
+
+
+@db_session
+def upsert_time_entries(time_entry_list):
+    """Insert or update a batch of transformed time entries with a single merge statement
+
+    :param time_entry_list: list of dicts keyed by time_entry_columns, with data warehouse fk's already resolved
+    :return: list of (entry id, exception) for the rows that could not be written
+    """
+    return bulk_upsert(table_name='time_entry', columns=time_entry_columns, rows=time_entry_list)
+
+
+def bulk_upsert(table_name, columns, rows, key_column='id'):
+    """Merge rows into a table keyed on key_column, inserting new keys and updating existing ones
+
+    On PostgreSQL the rows are COPY'd into a temp staging table and merged with INSERT ... ON CONFLICT DO UPDATE.
+    Other providers (the SQLite unit test db) use a multi-row INSERT ... ON CONFLICT instead.
+    If the merge fails the batch is split in half and each half retried, so one bad row only fails itself.
+    Must be called inside a db_session, the caller's session commits the work.
+
+    :return: list of (key, exception) for the rows that could not be written
+    """
+    if not rows:
+        return []
+
+    cursor = db.get_connection().cursor()
+    if db.provider_name == 'postgres':
+        stage_table = 'stage_{}'.format(table_name)
+        # The staging table lives for the connection and empties itself on commit
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {table}) ON COMMIT DELETE ROWS"
+                       .format(stage=stage_table, table=table_name))
+        merge = lambda batch: copy_and_merge(cursor, table_name, stage_table, columns, batch, key_column)
+    else:
+        merge = lambda batch: insert_and_merge(cursor, table_name, columns, batch, key_column)
+
+    return merge_with_isolation(cursor, merge, rows, key_column)
+
+
+def merge_with_isolation(cursor, merge, rows, key_column):
+    """Runs merge(rows) in a savepoint, bisecting the batch on failure until the bad rows are found"""
+    cursor.execute("SAVEPOINT bulk_upsert")
+    try:
+        merge(rows)
+        cursor.execute("RELEASE SAVEPOINT bulk_upsert")
+        return []
+    except Exception as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT bulk_upsert")
+        cursor.execute("RELEASE SAVEPOINT bulk_upsert")
+        if len(rows) == 1:
+            return [(rows[0][key_column], e)]
+
+    half = len(rows) // 2
+    return (merge_with_isolation(cursor, merge, rows[:half], key_column) +
+            merge_with_isolation(cursor, merge, rows[half:], key_column))
+
+
+def copy_and_merge(cursor, table_name, stage_table, columns, rows, key_column):
+    """PostgreSQL merge: COPY the rows into the staging table, then upsert them into the target in one statement"""
+    column_list = ', '.join(columns)
+    updates = ', '.join('{c} = EXCLUDED.{c}'.format(c=c) for c in columns if c != key_column)
+
+    buffer = make_csv_buffer([tuple(row[c] for c in columns) for row in rows])
+
+    cursor.execute("TRUNCATE {stage}".format(stage=stage_table))
+    cursor.copy_expert("COPY {stage} ({cols}) FROM STDIN WITH (FORMAT csv)".format(stage=stage_table,
+                                                                                  cols=column_list), buffer)
+    cursor.execute("INSERT INTO {table} ({cols}) SELECT {cols} FROM {stage} "
+                   "ON CONFLICT ({key}) DO UPDATE SET {updates}".format(table=table_name, cols=column_list,
+                                                                        stage=stage_table, key=key_column,
+                                                                        updates=updates))
+
+
+def insert_and_merge(cursor, table_name, columns, rows, key_column):
+    """SQLite merge: one INSERT ... ON CONFLICT statement run for every row in the batch"""
+    column_list = ', '.join(columns)
+    placeholders = ', '.join('?' for c in columns)
+    updates = ', '.join('{c} = excluded.{c}'.format(c=c) for c in columns if c != key_column)
+    sql = ("INSERT INTO {table} ({cols}) VALUES ({ph}) ON CONFLICT ({key}) DO UPDATE SET {updates}"
+           .format(table=table_name, cols=column_list, ph=placeholders, key=key_column, updates=updates))
+    cursor.executemany(sql, [tuple(row[c] for c in columns) for row in rows])
+
+
+def make_csv_buffer(value_rows):
+    """Writes rows of values to an in-memory CSV file that PostgreSQL's COPY can read"""
+    # Quote every value so empty strings stay empty strings, None is left bare so COPY reads it as NULL
+    buffer = StringIO()
+    for values in value_rows:
+        fields = ['' if v is None else '"{}"'.format(str(v).replace('"', '""')) for v in values]
+        buffer.write(','.join(fields) + '\n')
+    buffer.seek(0)
+    return buffer
+
+
+# Column order used when bulk loading split time assignments
+time_assignment_columns = ['parent_id', 'person_id', 'project_id', 'assign_date', 'allocation', 'updated_at']
+
+
+@db_session
+def insert_time_assignments(assignment_block):
+    """Insert a block of split time assignments with a single statement
+
+    :param assignment_block: dict of equal length arrays (or lists) keyed by time_assignment_columns
+    """
+    columns = [list(assignment_block[c]) for c in time_assignment_columns]
+    # NumPy values (datetime64, int64) are turned back into plain Python dates and ints for the db driver
+    value_rows = [tuple(v.item() if hasattr(v, 'item') else v for v in row) for row in zip(*columns)]
+    bulk_insert(table_name='time_assignment', columns=time_assignment_columns, value_rows=value_rows)
+
+
+@db_session
+def replace_time_assignments(parent_ids, assignment_block):
+    """Deletes every split assignment of the given parents and inserts the new block in their place
+
+    One DELETE and one bulk insert in the caller's transaction, so the swap commits or rolls back as a whole.
+
+    :return: number of old rows deleted
+    """
+    deleted_count = delete_by_ids(table_name='time_assignment', ids=parent_ids, key_column='parent_id')
+    insert_time_assignments(assignment_block=assignment_block)
+    return deleted_count
+
+
+def bulk_insert(table_name, columns, value_rows):
+    """Insert rows of values in one go. COPY on PostgreSQL, a single executemany INSERT elsewhere
+
+    Must be called inside a db_session, the caller's session commits the work.
+    """
+    if not value_rows:
+        return
+
+    cursor = db.get_connection().cursor()
+    column_list = ', '.join(columns)
+    if db.provider_name == 'postgres':
+        cursor.copy_expert("COPY {table} ({cols}) FROM STDIN WITH (FORMAT csv)".format(table=table_name,
+                                                                                      cols=column_list),
+                           make_csv_buffer(value_rows))
+    else:
+        placeholders = ', '.join('?' for c in columns)
+        cursor.executemany("INSERT INTO {table} ({cols}) VALUES ({ph})".format(table=table_name, cols=column_list,
+                                                                               ph=placeholders), value_rows)
+
+
 @db_session
 def copy_to_legacy_entries():
     db.execute("""INSERT INTO harvest_entries 
@@ -80,6 +247,44 @@ def copy_to_legacy_entries():
                   FROM time_entry te);""")
 
 
+# harvest_entries column and the time_entry column it is copied from
+legacy_entry_columns = [('entry_id', 'id'), ('hours', 'hours'), ('spent_date', 'spent_date'),
+                        ('billable', 'billable'), ('billable_rate', 'billable_rate'), ('created_at', 'created_at'),
+                        ('updated_at', 'updated_at'), ('entry_amount', 'entry_amount'), ('user_id', 'person_id'),
+                        ('user_name', 'person_name'), ('harvest_project_id', 'project_id'),
+                        ('harvest_project_name', 'project_name'), ('harvest_project_code', 'project_code'),
+                        ('client_id', 'client_id'), ('client_name', 'client_name'), ('task_id', 'task_id'),
+                        ('task_name', 'task_name')]
+
+
+@db_session
+def upsert_legacy_entries(entry_ids):
+    """Copy just the given time entries to the legacy harvest_entries table, updating the ones already there
+
+    Lets a diff load keep the legacy table current in proportion to what changed, instead of rewriting all of it.
+    """
+    entry_ids = [int(i) for i in entry_ids]
+    if not entry_ids:
+        return
+
+    cursor = db.get_connection().cursor()
+    legacy_cols = ', '.join(legacy for legacy, te in legacy_entry_columns)
+    te_cols = ', '.join('te.{}'.format(te) for legacy, te in legacy_entry_columns)
+    updates = ', '.join('{c} = excluded.{c}'.format(c=legacy) for legacy, te in legacy_entry_columns[1:])
+    sql = ("INSERT INTO harvest_entries ({legacy_cols}) SELECT {te_cols} FROM time_entry te WHERE te.id {match} "
+           "ON CONFLICT (entry_id) DO UPDATE SET {updates}")
+
+    if db.provider_name == 'postgres':
+        cursor.execute(sql.format(legacy_cols=legacy_cols, te_cols=te_cols, match='= ANY(%s)', updates=updates),
+                       (entry_ids,))
+    else:
+        for start in range(0, len(entry_ids), 900):
+            id_chunk = entry_ids[start:start + 900]
+            match = 'IN ({})'.format(', '.join('?' for i in id_chunk))
+            cursor.execute(sql.format(legacy_cols=legacy_cols, te_cols=te_cols, match=match, updates=updates),
+                           id_chunk)
+
+
 """
 READ:
 The following fuctions fetch info from the db
@@ -157,21 +362,124 @@ def get_client_by_id(identifier):
     return client
 
 
+class IdCache(object):
+    """Maps Harvest and Forecast ids to data warehouse ids for the Person, Project, and Client tables
+
+    load() reads each table once at the start of a run so resolving a fk is a dict lookup instead of up to two queries.
+    Munge stages add() rows as they write them, and a miss falls back to the db so a stale cache can't lose a record.
+    """
+    entities = [Person, Project, Client]
+
+    def __init__(self):
+        self.harvest_ids = {entity: {} for entity in self.entities}
+        self.forecast_ids = {entity: {} for entity in self.entities}
+
+    @db_session
+    def load(self):
+        for entity in self.entities:
+            id_rows = select((e.id, e.harvest_id, e.forecast_id) for e in entity)[:]
+            for dw_id, harvest_id, forecast_id in id_rows:
+                self.__remember__(entity, dw_id, harvest_id, forecast_id)
+
+    def add(self, record):
+        """Remember the source ids of a Person, Project, or Client record that was just written"""
+        self.__remember__(type(record), record.id, record.harvest_id, record.forecast_id)
+
+    def resolve(self, entity, identifier):
+        """Same lookup as the get_*_by_id functions (Harvest id first, then Forecast id) but returns the dw id
+
+        :param entity: Person, Project, or Client
+        :param identifier: int - Forecast or Harvest id
+        :return: data warehouse id, or None if there is no matching record
+        """
+        dw_id = self.harvest_ids[entity].get(identifier)
+        if dw_id is None:
+            dw_id = self.forecast_ids[entity].get(identifier)
+        if dw_id is None:
+            record = get_by_source_id(entity, identifier)
+            if record:
+                self.add(record)
+                dw_id = record.id
+        return dw_id
+
+    def __remember__(self, entity, dw_id, harvest_id, forecast_id):
+        if harvest_id is not None:
+            self.harvest_ids[entity][harvest_id] = dw_id
+        if forecast_id is not None:
+            self.forecast_ids[entity][forecast_id] = dw_id
+
+
+@db_session
+def get_by_source_id(entity, identifier):
+    """Search a Person, Project, or Client table for a matching Harvest or Forecast id"""
+    record = entity.get(harvest_id=identifier)
+    if not record:
+        record = entity.get(forecast_id=identifier)
+    return record
+
+
 @db_session
 def get_time_entry_table():
     te_tbl = select(te for te in Time_Entry)[:]
     return te_tbl
 
 
+watermark_tables = {'person': Person, 'project': Project, 'client': Client, 'task': Task, 'time_entry': Time_Entry,
+                    'time_assignment': Time_Assignment}
+
+
 @db_session
 def get_updated_from_dates():
-    mp = max(person.updated_at for person in Person)
-    mpr = max(proj.updated_at for proj in Project)
-    mc = max(cli.updated_at for cli in Client)
-    mtsk = max(tsk.updated_at for tsk in Task)
-    mte = max(te.updated_at for te in Time_Entry)
-    mta = max(ta.updated_at for ta in Time_Assignment)
-    return {'person': mp, 'project': mpr, 'client': mc, 'task': mtsk, 'time_entry': mte, 'time_assignment': mta}
+    """Returns the high-water mark of each table, read from load_watermark in one query
+
+    A table without a stored mark (e.g. the first diff load after load_watermark was added) gets one from its max
+    updated_at, which is then saved so the scan only happens once. Tables with no rows come back as None.
+    """
+    marks = {w.name: w.high_water for w in Load_Watermark.select()}
+    for name, entity in watermark_tables.items():
+        if name not in marks:
+            marks[name] = max(row.updated_at for row in entity)
+            if marks[name] is not None:
+                set_watermark(name=name, high_water=marks[name])
+    return marks
+
+
+@db_session
+def set_watermark(name, high_water):
+    """Moves a table's high-water mark forward to high_water, a mark is never moved back"""
+    mark = Load_Watermark.get(name=name)
+    if mark is None:
+        Load_Watermark(name=name, high_water=high_water, updated_at=datetime.now())
+    elif high_water > mark.high_water:
+        mark.set(high_water=high_water, updated_at=datetime.now())
+
+
+@db_session
+def get_http_cache(key):
+    """Returns the cached etag, last_modified and body of a request key as a dict, or None if it isn't cached"""
+    cached = Http_Cache.get(key=key)
+    if cached is None:
+        return None
+    return {'etag': cached.etag, 'last_modified': cached.last_modified, 'body': cached.body}
+
+
+@db_session
+def set_http_cache(key, etag, last_modified, body):
+    """Saves the validators and body of a full response, replacing what was cached for the key"""
+    cached = Http_Cache.get(key=key)
+    if cached is None:
+        Http_Cache(key=key, etag=etag, last_modified=last_modified, body=body, stored_at=datetime.now())
+    else:
+        cached.set(etag=etag, last_modified=last_modified, body=body, stored_at=datetime.now())
+
+
+@db_session
+def prune_http_cache(older_than):
+    """Deletes cached responses stored before older_than, e.g. keys a diff load's updated_since has moved past
+
+    :return: number of rows deleted
+    """
+    return delete(c for c in Http_Cache if c.stored_at < older_than)
 
 
 """
@@ -180,6 +488,69 @@ DELETE
 These functions trunc or delete records
 """
 
+@db_session
+def delete_by_ids(table_name, ids, key_column='id'):
+    """Delete every row of a table whose key_column value is in ids with one statement
+
+    :return: number of rows deleted
+    """
+    ids = [int(i) for i in ids]
+    if not ids:
+        return 0
+
+    cursor = db.get_connection().cursor()
+    if db.provider_name == 'postgres':
+        cursor.execute("DELETE FROM {table} WHERE {key} = ANY(%s)".format(table=table_name, key=key_column), (ids,))
+        return cursor.rowcount
+
+    # SQLite has no arrays, so fall back to IN lists that stay under its bound parameter limit
+    deleted = 0
+    for start in range(0, len(ids), 900):
+        id_chunk = ids[start:start + 900]
+        placeholders = ', '.join('?' for i in id_chunk)
+        cursor.execute("DELETE FROM {table} WHERE {key} IN ({ph})".format(table=table_name, key=key_column,
+                                                                          ph=placeholders), id_chunk)
+        deleted += cursor.rowcount
+    return deleted
+
+
+@db_session
+def delete_missing_from_source(table_name, key_column, source_ids, updated_since=None):
+    """Delete every row whose key_column value the source no longer has, with the db doing the anti-join
+
+    The source ids are streamed into a temp table (COPY on PostgreSQL) and a single DELETE ... WHERE NOT EXISTS
+    removes the rows without a match, so the table never has to be read into Python.
+
+    :param key_column: column holding the source id, rows where it is NULL count as missing
+    :param updated_since: optional datetime, only rows updated after it are considered
+    :return: number of rows deleted
+    """
+    cursor = db.get_connection().cursor()
+    is_postgres = db.provider_name == 'postgres'
+    param = '%s' if is_postgres else '?'
+    source_ids = set(source_ids)
+
+    if is_postgres:
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS source_ids (id BIGINT PRIMARY KEY) ON COMMIT DELETE ROWS")
+        cursor.execute("TRUNCATE source_ids")
+        cursor.copy_expert("COPY source_ids (id) FROM STDIN WITH (FORMAT csv)", make_csv_buffer((i,) for i in source_ids))
+        # Give the planner real row counts for the join
+        cursor.execute("ANALYZE source_ids")
+    else:
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS source_ids (id INTEGER PRIMARY KEY)")
+        cursor.execute("DELETE FROM source_ids")
+        cursor.executemany("INSERT INTO source_ids (id) VALUES (?)", [(i,) for i in source_ids])
+
+    sql = ("DELETE FROM {table} WHERE NOT EXISTS (SELECT 1 FROM source_ids WHERE source_ids.id = {table}.{key})"
+           .format(table=table_name, key=key_column))
+    params = []
+    if updated_since:
+        sql += " AND {table}.updated_at > {p}".format(table=table_name, p=param)
+        params.append(updated_since)
+    cursor.execute(sql, params)
+    return cursor.rowcount
+
+
 @db_session
 def trunc_legacy_entries():
     db.execute("TRUNCATE public.harvest_entries;")
@@ -34,7 +34,7 @@ class Person(db.Entity):
     roles = Optional(str, nullable=True)
     avatar_url = Optional(str, nullable=True)
     created_at = Optional(datetime)
-    updated_at = Optional(datetime)
+    updated_at = Optional(datetime, index=True)
     assignments = Set('Time_Assignment')
 
 
@@ -56,6 +56,8 @@ class Time_Entry(db.Entity):
     client_name = Optional(str)
     task_id = Required('Task')
     task_name = Optional(str)
+    # Covers the updated_at range scans of the time entry sync and watermark without visiting the table
+    composite_index(updated_at, id)
 
 
 class Project(db.Entity):
@@ -72,7 +74,7 @@ class Project(db.Entity):
     budget = Optional(Decimal)
     budget_is_monthly = Optional(bool)
     created_at = Optional(datetime)
-    updated_at = Optional(datetime)
+    updated_at = Optional(datetime, index=True)
     starts_on = Optional(date)
     ends_on = Optional(date)
     assignments = Set('Time_Assignment')
@@ -87,14 +89,14 @@ class Client(db.Entity):
     time_entries = Set(Time_Entry)
     projects = Set(Project)
     created_at = Optional(datetime)
-    updated_at = Optional(datetime)
+    updated_at = Optional(datetime, index=True)
 
 
 class Task(db.Entity):
     id = PrimaryKey(int, auto=True)
     name = Optional(str)
     time_entries = Set(Time_Entry)
-    updated_at = Optional(datetime)
+    updated_at = Optional(datetime, index=True)
 
 
 class Time_Assignment(db.Entity):
@@ -104,7 +106,9 @@ class Time_Assignment(db.Entity):
     project_id = Required(Project)
     assign_date = Optional(date)
     allocation = Optional(Decimal)
-    updated_at = Optional(datetime)
+    updated_at = Optional(datetime, index=True)
+    # Split days are looked up, replaced and synced by their Forecast parent id
+    composite_index(parent_id, id)
 
 
 
@@ -127,6 +131,23 @@ class Harvest_Entries(db.Entity):
     client_name = Optional(str, nullable=True)
     task_id = Optional(int)
     task_name = Optional(str, nullable=True)
+    composite_index(updated_at, entry_id)
+
+
+class Load_Watermark(db.Entity):
+    """Newest source updated_at loaded into each table, where diff loads pick up from"""
+    name = PrimaryKey(str)
+    high_water = Required(datetime)
+    updated_at = Required(datetime)
+
+
+class Http_Cache(db.Entity):
+    """Validators and body of the last full response to a conditional GET, see CachedSession in datagrabber.py"""
+    key = PrimaryKey(str)
+    etag = Optional(str, nullable=True)
+    last_modified = Optional(str, nullable=True)
+    body = Required(LongStr)
+    stored_at = Required(datetime, index=True)
 
 
 # Create log table
@@ -7,19 +7,32 @@ datetime_format_ms= '%Y-%m-%dT%H:%M:%S.%fZ'
 date_format = '%Y-%m-%d'
 full_load_datetime = '1984-12-31T00:00:00Z'
 from sys import stdout
+from itertools import islice
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, local
+from time import perf_counter
+from math import ceil
 from controllers.ormobjects import DataRocketLog
 from controllers.ormcontroller import db, db_session
+from data_rocket_conf import config as conf
 
 class LoggerBot(object):
     """
     LoggerBot handles tracking record counts, messaging to console, and sending logs to the datarocketlog table
+
+    Errors hit while loading rows are buffered per stage with record_error() and written as one log row when the stage
+    finishes, so a load that fails on every row doesn't also pay for a transaction per failure.
     """
-    def __init__(self):
+    def __init__(self, error_sample_size=conf['ERROR_SAMPLE_SIZE']):
         self.load_success = False
         self.load_description = ''
         self.load_start = datetime.now()
         self.load_end = datetime.strptime('1984-12-03T00:00:00Z', datetime_format)
         self.load_documents = []
+        self.error_sample_size = int(error_sample_size)
+        self.error_lock = Lock()
+        self.error_buffers = {}
 
     def write_load_completion(self, documents, description='load completed', success=False):
         description = description
@@ -31,30 +44,225 @@ class LoggerBot(object):
             row = DataRocketLog(event_description=description, event_datetime=now, event_success=success,
                                 event_documents=docs)
 
-    def print_progress_bar(self, iteration, total, prefix='Progress:', suffix='Complete'
-                           , decimals=1, length=100):
-        """Call in a loop to create terminal progress bar
-
-        @params:
-            iteration   - Required  : current iteration (Int)
-            total       - Required  : total iterations (Int)
-            prefix      - Optional  : prefix string (Str)
-            suffix      - Optional  : suffix string (Str)
-            decimals    - Optional  : positive number of decimals in percent complete (Int)
-            length      - Optional  : character length of bar (Int)
-            fill        - Optional  : bar fill character (Str)
+    def record_error(self, description, record_id, error, error_type=None):
+        """Adds one failed record to the error buffer of the stage the calling thread is in
+
+        Errors are counted by type, the exception's class name unless error_type is given, and only the first
+        error_sample_size get their id and message kept.
         """
-        if total > 0:
-            percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(total)))
-            filledLength = int(length * iteration // total)
-            bar = '.' * filledLength + '-' * (length - filledLength)
-            record_count = '({} Records)'.format(total)
-            stdout.write('\r{} {}% {} {}'.format(prefix, percent, suffix, record_count))
-            # Print New Line on Complete
-            if iteration == total:
-                stdout.write('\nAll Done\n')
-        else:
+        if error_type is None:
+            error_type = type(error).__name__ if isinstance(error, Exception) else 'Error'
+        stage = metrics.current_stage()
+
+        with self.error_lock:
+            buffer = self.error_buffers.setdefault(stage, {'error_count': 0, 'by_type': {}, 'samples': []})
+            buffer['error_count'] += 1
+            buffer['by_type'].update({error_type: buffer['by_type'].get(error_type, 0) + 1})
+            if len(buffer['samples']) < self.error_sample_size:
+                buffer['samples'].append({'description': description, 'id': str(record_id), 'type': error_type,
+                                          'message': str(error)})
+
+    def flush_errors(self, stage=None):
+        """Writes the buffered errors of a stage, or of every stage if none is given, as one log row each"""
+        with self.error_lock:
+            stages = [stage] if stage is not None else list(self.error_buffers.keys())
+            buffers = [(name, self.error_buffers.pop(name)) for name in stages if name in self.error_buffers]
+
+        for name, buffer in buffers:
+            buffer.update(stage=name, samples_dropped=buffer['error_count'] - len(buffer['samples']))
+            print('{count} errors in {stage}: {types}'.format(count=buffer['error_count'], stage=name,
+                                                              types=buffer['by_type']))
+            self.write_load_completion(documents=buffer,
+                                       description='{} errors ({})'.format(name, buffer['error_count']))
+
+    def progress(self, total, prefix='Progress:'):
+        """Starts a throttled progress report for a loop over total records"""
+        return ProgressReporter(total=total, prefix=prefix)
+
+
+class ProgressReporter(object):
+    """
+    ProgressReporter shows how far a loop has got, cheap enough to call update() on every record
+
+    On a terminal the progress bar is redrawn at most max_hz times a second, and only after moving step_percent.
+    Anywhere else (e.g. Heroku's log drain) a key=value log line with the rate and ETA is printed every log_seconds
+    instead, so a long load doesn't write a line per record.
+    """
+    def __init__(self, total, prefix='Progress:', stream=None, is_tty=None, max_hz=conf['PROGRESS_MAX_HZ'],
+                 step_percent=conf['PROGRESS_STEP_PERCENT'], log_seconds=conf['PROGRESS_LOG_SECONDS']):
+        self.total = total
+        self.prefix = prefix
+        self.stream = stream or stdout
+        self.is_tty = self.stream.isatty() if is_tty is None else is_tty
+        self.min_interval = 1 / float(max_hz) if self.is_tty else float(log_seconds)
+        self.step = max(int(total * float(step_percent) / 100), 1)
+        self.start = perf_counter()
+        self.last_report = self.start
+        # Never past total, so the last record is always reported even when total isn't a multiple of step
+        self.next_check = min(self.step, total)
+        self.finished = total <= 0
+
+        if self.finished:
             print("No records to process")
+        elif self.is_tty:
+            self.__draw_bar__(0)
+
+    def update(self, iteration):
+        """Reports progress if iteration has moved a step and enough time has passed since the last report"""
+        # Most calls stop here, so the per-record cost is one comparison
+        if iteration < self.next_check or self.finished:
+            return
+        self.next_check = min(iteration + self.step, self.total)
+
+        now = perf_counter()
+        if iteration >= self.total:
+            self.finished = True
+        elif now - self.last_report < self.min_interval:
+            return
+        self.last_report = now
+
+        if self.is_tty:
+            self.__draw_bar__(iteration)
+        else:
+            self.__log_line__(iteration, now)
+
+    def __draw_bar__(self, iteration):
+        percent = 100 * (iteration / float(self.total))
+        self.stream.write('\r{} {:.1f}% Complete ({} Records)'.format(self.prefix, percent, self.total))
+        # Print New Line on Complete
+        if iteration >= self.total:
+            self.stream.write('\nAll Done\n')
+        self.stream.flush()
+
+    def __log_line__(self, iteration, now):
+        elapsed = now - self.start
+        rate = iteration / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - iteration) / rate if rate > 0 else 0.0
+        self.stream.write('progress="{prefix}" done={done} total={total} pct={pct:.1f} rate={rate:.1f}/s '
+                          'eta={eta:.0f}s\n'.format(prefix=self.prefix, done=iteration, total=self.total,
+                                                    pct=100 * (iteration / float(self.total)), rate=rate, eta=eta))
+        self.stream.flush()
+
+
+class LoadMetrics(object):
+    """
+    LoadMetrics collects timings and counters for one run and writes them to the datarocketlog table as one JSON document
+
+    Stages are named blocks of work (a get_, munge_, or sync_ call) timed with the stage() context manager or the timed
+    decorator. Row counts go to whichever stage the calling thread is in. HTTP requests are tracked per API endpoint
+    since the page fetches run on worker threads outside of any stage.
+    """
+    row_counters = ['rows_inserted', 'rows_updated', 'rows_upserted', 'rows_deleted']
+
+    def __init__(self):
+        self.lock = Lock()
+        self.thread_state = local()
+        self.stages = {}
+        self.endpoints = {}
+        self.run_start = datetime.now()
+
+    @contextmanager
+    def stage(self, name):
+        """Times the wrapped block as the named stage, nested stages are timed on their own"""
+        stack = self.__stage_stack__()
+        stack.append(name)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            stack.pop()
+            with self.lock:
+                stage = self.__get_stage__(name)
+                stage['calls'] += 1
+                stage['wall_seconds'] += perf_counter() - start
+            logger.flush_errors(name)
+
+    def timed(self, func):
+        """Decorator version of stage(), named after the function"""
+        @wraps(func)
+        def timed_func(*args, **kwargs):
+            with self.stage(func.__name__):
+                return func(*args, **kwargs)
+        return timed_func
+
+    def count(self, counter, amount=1):
+        """Adds to a counter (e.g. rows_inserted) of the stage the calling thread is in"""
+        name = self.current_stage()
+        with self.lock:
+            stage = self.__get_stage__(name)
+            stage.update({counter: stage.get(counter, 0) + amount})
+
+    def current_stage(self):
+        """Name of the innermost stage the calling thread is in"""
+        stack = self.__stage_stack__()
+        return stack[-1] if stack else 'unstaged'
+
+    def record_request(self, endpoint, seconds, retries=0):
+        """Tracks one HTTP page fetch for an endpoint, including how many tries it took"""
+        with self.lock:
+            ep = self.endpoints.setdefault(endpoint, {'pages': 0, 'retries': 0, 'latencies': []})
+            ep['pages'] += 1
+            ep['retries'] += retries
+            ep['latencies'].append(seconds)
+
+    def count_endpoint(self, endpoint, counter, amount=1):
+        """Adds to a counter of an endpoint (e.g. duplicates_skipped)"""
+        with self.lock:
+            ep = self.endpoints.setdefault(endpoint, {'pages': 0, 'retries': 0, 'latencies': []})
+            ep.update({counter: ep.get(counter, 0) + amount})
+
+    def summary(self):
+        """Rolls the raw numbers up into a JSON friendly dict with rates and latency percentiles"""
+        with self.lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                stage = dict(stage)
+                rows = sum(stage.get(counter, 0) for counter in self.row_counters)
+                if rows and stage['wall_seconds']:
+                    stage.update(rows_per_sec=round(rows / stage['wall_seconds'], 1))
+                stage.update(wall_seconds=round(stage['wall_seconds'], 3))
+                stages[name] = stage
+
+            endpoints = {}
+            for name, ep in self.endpoints.items():
+                ep = dict(ep)
+                latencies = sorted(ep.pop('latencies'))
+                for pct in [50, 90, 99]:
+                    ep['latency_p{}_ms'.format(pct)] = round(percentile(latencies, pct) * 1000, 1)
+                endpoints[name] = ep
+
+        return {'run_start': self.run_start.strftime(datetime_format),
+                'run_seconds': round((datetime.now() - self.run_start).total_seconds(), 3),
+                'stages': stages, 'endpoints': endpoints}
+
+    def write(self, description='load metrics', success=True):
+        """Saves this run's summary to the datarocketlog table"""
+        logger.write_load_completion(documents=self.summary(), description=description, success=success)
+
+    def __stage_stack__(self):
+        if not hasattr(self.thread_state, 'stack'):
+            self.thread_state.stack = []
+        return self.thread_state.stack
+
+    def __get_stage__(self, name):
+        return self.stages.setdefault(name, {'calls': 0, 'wall_seconds': 0.0})
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list, 0 if the list is empty"""
+    if not sorted_values:
+        return 0
+    rank = max(ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def chunked(iterable, size):
+    """Yields lists of up to size items from any iterable, so long streams can be worked in bounded batches"""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
 
 
 def process_args(argv):
@@ -68,10 +276,18 @@ def process_args(argv):
               'tasks': False,
               'projects': False,
               'assignments': False,
-              'time_entries': False,}
+              'time_entries': False,
+              'verify_indexes': False,
+              'archive': False,
+              'replay': False,}
 
     load_list = ['full_load', 'all_tables', 'people', 'clients', 'tasks', 'projects', 'assignments', 'time_entries']
 
+    if 'verify_indexes' in argv[1:]:
+        config.update(verify_indexes=True)
+        print('Verifying database indexes')
+        return config
+
     if len(argv) > 1:
         args = argv[1:]
         start_list = []
@@ -81,6 +297,11 @@ def process_args(argv):
                 start_list.append(item)
 
         start_string = 'Starting {} data load'.format(', '.join([s for s in start_list]))
+        # Where the API responses come from or go to is separate from what gets loaded
+        for item in ['archive', 'replay']:
+            if item in args:
+                config.update({item: True})
+                start_string += ' ({} API responses)'.format('archiving' if item == 'archive' else 'replaying')
         print(start_string)
         return config
 
@@ -90,6 +311,7 @@ def process_args(argv):
         return config
 
 
-""" Instantiate a logger bot for the other files to use"""
+""" Instantiate a logger bot and run metrics for the other files to use"""
 
-logger = LoggerBot()
\ No newline at end of file
+logger = LoggerBot()
+metrics = LoadMetrics()
\ No newline at end of file
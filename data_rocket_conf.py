@@ -7,4 +7,23 @@ config = {'DEBUG': os.environ.get('DEBUG'),
           'FORECAST_ACCOUNT_ID': os.environ.get('FORECAST_ACCOUNT_ID'),
           'HARVEST_ACCOUNT_ID': os.environ.get('HARVEST_ACCOUNT_ID'),
           'USER_AGENT': os.environ.get('USER_AGENT'),
-          'FROM_DATE': os.environ.get('FROM_DATE')}
\ No newline at end of file
+          'FROM_DATE': os.environ.get('FROM_DATE'),
+          'HARVEST_CONCURRENCY': os.environ.get('HARVEST_CONCURRENCY', 4),
+          'HARVEST_PAGINATION': os.environ.get('HARVEST_PAGINATION', 'pages'),
+          'HTTP_POOL_SIZE': os.environ.get('HTTP_POOL_SIZE', 10),
+          'LOAD_BATCH_SIZE': os.environ.get('LOAD_BATCH_SIZE', 1000),
+          'SYNC_MODE': os.environ.get('SYNC_MODE', 'server'),
+          'STAGE_CONCURRENCY': os.environ.get('STAGE_CONCURRENCY', 4),
+          'ERROR_SAMPLE_SIZE': os.environ.get('ERROR_SAMPLE_SIZE', 20),
+          'PROGRESS_MAX_HZ': os.environ.get('PROGRESS_MAX_HZ', 4),
+          'PROGRESS_STEP_PERCENT': os.environ.get('PROGRESS_STEP_PERCENT', 1),
+          'PROGRESS_LOG_SECONDS': os.environ.get('PROGRESS_LOG_SECONDS', 15),
+          'SQLITE_FILE': os.environ.get('SQLITE_FILE', 'unit_test.sqlite'),
+          'HARVEST_BASE_URL': os.environ.get('HARVEST_BASE_URL', 'https://api.harvestapp.com/v2/'),
+          'FORECAST_BASE_URL': os.environ.get('FORECAST_BASE_URL', 'https://api.forecastapp.com/'),
+          'ARCHIVE_DIR': os.environ.get('ARCHIVE_DIR', 'archive'),
+          'REPLAY_RUN': os.environ.get('REPLAY_RUN'),
+          'HTTP_CACHE_PATHS': os.environ.get('HTTP_CACHE_PATHS', '/people,/clients,/projects,/v2/users'),
+          'HTTP_CACHE_DAYS': os.environ.get('HTTP_CACHE_DAYS', 30),
+          'HTTP_CONNECT_TIMEOUT': os.environ.get('HTTP_CONNECT_TIMEOUT', 10),
+          'HTTP_READ_TIMEOUT': os.environ.get('HTTP_READ_TIMEOUT', 60)}
\ No newline at end of file
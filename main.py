@@ -1,7 +1,9 @@
 # Imports
 from controllers.datapusher import PusherBot
 from sys import argv
-from controllers.utilitybot import process_args, logger
+from controllers.utilitybot import process_args, logger, metrics
+from controllers.ormcontroller import verify_indexes, prune_http_cache
+from datetime import datetime, timedelta
 from data_rocket_conf import config as drc
 
 """
@@ -11,15 +13,29 @@ Planned support: Namely, Xero
 """
 config = process_args(argv)
 
-if __name__ == '__main__':
+if __name__ == '__main__' and config['verify_indexes']:
+    # Only check the connected database for declared indexes it doesn't have
+    missing_indexes = verify_indexes()
+    print('Missing indexes: {}'.format(', '.join(missing_indexes) if missing_indexes else 'none'))
+
+elif __name__ == '__main__':
 
     # Make the PusherBot
-    pb = PusherBot()
+    pb = PusherBot(archive=config['archive'], replay=config['replay'])
 
     # Load all data flagged as true and push to db
-    pb.load_data(full_load=config['full_load'], all_tables=config['all_tables'], people=config['people'], clients=config['clients'],
-                 tasks=config['tasks'], projects=config['projects'], assignments=config['assignments'],
-                 time_entries=config['time_entries'])
+    load_success = False
+    try:
+        pb.load_data(full_load=config['full_load'], all_tables=config['all_tables'], people=config['people'],
+                     clients=config['clients'], tasks=config['tasks'], projects=config['projects'],
+                     assignments=config['assignments'], time_entries=config['time_entries'])
+        load_success = True
+    finally:
+        # Write to completion log, along with any errors raised outside a stage and the run's timings and row counts.
+        # A failed load needs these most, so they're written whether or not it finished.
+        logger.flush_errors()
+        logger.write_load_completion(argv[1:], success=load_success)
+        metrics.write(success=load_success)
 
-    # Write to completion log
-    logger.write_load_completion(argv[1:], success=True)
+    # Cached reference responses not refreshed in HTTP_CACHE_DAYS are dropped, the next request just downloads again
+    prune_http_cache(older_than=datetime.now() - timedelta(days=int(drc['HTTP_CACHE_DAYS'])))
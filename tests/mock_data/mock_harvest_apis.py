@@ -33,6 +33,10 @@ class MockHarvester(MockParent):
         hte['time_entries'] = self.filter_results(hte['time_entries'], filters)
         return hte
 
+    def iter_harvest_time_entries(self, updated_since):
+        for entry in self.get_harvest_time_entries(updated_since)['time_entries']:
+            yield entry
+
     def get_harvest_users(self, updated_since):
         json_copy = harvest_users
         h_peeps = json.loads(json_copy)
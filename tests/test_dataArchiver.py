@@ -0,0 +1,86 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main as utmain
+from benchmarks.synthetic_data import SyntheticSource, SyntheticSession
+from controllers.dataarchiver import ResponseArchive, ArchivingSession, ReplaySession
+from controllers.datagrabber import Harvester, Forecaster, RequestScheduler
+
+
+class TestDataArchiver(TestCase):
+    """Tests that an archived pull replays to the same records without touching the source"""
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.source = SyntheticSource.at_scale('tiny', time_entries=350)
+        self.scheduler = RequestScheduler(rate_limit=100000, rate_window=1)
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def make_grabbers(self, session):
+        harv = Harvester()
+        fore = Forecaster()
+        for grabber in [harv, fore]:
+            grabber.session = session
+            grabber.scheduler = self.scheduler
+        return harv, fore
+
+    def archive_run(self):
+        archive = ResponseArchive(run_id='20181001-020000', directory=self.directory)
+        harv, fore = self.make_grabbers(session=None)
+        harv.session = ArchivingSession(session=SyntheticSession(self.source), archive=archive, source='harvest')
+        fore.session = ArchivingSession(session=SyntheticSession(self.source), archive=archive, source='forecast')
+
+        entries = harv.get_harvest_time_entries(updated_since='1984-12-31T00:00:00Z')['time_entries']
+        clients = (harv.get_harvest_clients(updated_since='1984-12-31T00:00:00Z')['clients'],
+                   fore.get_forecast_clients()['clients'])
+        archive.close()
+        return entries, clients
+
+    def replay_grabbers(self):
+        archive = ResponseArchive.for_replay(run_id=None, directory=self.directory)
+        harv, fore = self.make_grabbers(session=None)
+        harv.session = ReplaySession(archive=archive, source='harvest')
+        fore.session = ReplaySession(archive=archive, source='forecast')
+        # One request an hour, a replay that waited on the rate limit would hang here
+        harv.scheduler = fore.scheduler = RequestScheduler(rate_limit=1, rate_window=3600)
+        return harv, fore
+
+    def test_replay_matches_archived_pull(self):
+        entries, (harvest_clients, forecast_clients) = self.archive_run()
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory, '20181001-020000'))),
+                         ['forecast_clients.jsonl.gz', 'harvest_clients.jsonl.gz', 'harvest_time_entries.jsonl.gz'])
+
+        harv, fore = self.replay_grabbers()
+        self.assertEqual(harv.get_harvest_time_entries(updated_since='1984-12-31T00:00:00Z')['time_entries'], entries)
+        # Harvest and Forecast both have a clients endpoint, each replays its own
+        self.assertEqual(harv.get_harvest_clients(updated_since='1984-12-31T00:00:00Z')['clients'], harvest_clients)
+        self.assertEqual(fore.get_forecast_clients()['clients'], forecast_clients)
+
+    def test_replay_with_other_dates(self):
+        """A diff load replayed on another day gets the archived run's pages"""
+        entries, clients = self.archive_run()
+        harv, fore = self.replay_grabbers()
+        self.assertEqual(harv.get_harvest_time_entries(updated_since='2018-10-01T00:00:00Z')['time_entries'], entries)
+
+    def test_second_load_appends(self):
+        """Writing again after close, as a second load in the same run does, keeps what was already saved"""
+        archive = ResponseArchive(run_id='20181001-020000', directory=self.directory)
+        for page in [1, 2]:
+            archive.write(source='harvest', url='http://archive.test/v2/users', params={'page': page}, status=200,
+                          body='{}')
+            archive.close()
+
+        queries = [response['query'] for response in archive.read(source='harvest', path='/v2/users')]
+        self.assertEqual(queries, ['page=1', 'page=2'])
+
+    def test_replay_without_archived_endpoint(self):
+        self.archive_run()
+        harv, fore = self.replay_grabbers()
+        with self.assertRaises(ValueError):
+            harv.get_harvest_users(updated_since='1984-12-31T00:00:00Z')
+
+
+if __name__ == '__main__':
+    utmain()
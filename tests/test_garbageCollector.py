@@ -0,0 +1,77 @@
+from unittest import TestCase, main as utmain
+from datetime import date, datetime, timedelta
+from controllers.datacleanser import GarbageCollector
+from controllers.datagrabber import SourceSnapshot
+from tests.mock_data.mock_harvest_apis import MockHarvester, MockForecaster
+from controllers.ormcontroller import db, db_session, select
+from controllers.ormobjects import *
+
+
+class TestGarbageCollector(TestCase):
+    """Tests that records deleted from the sources are removed from the data warehouse"""
+
+    def setUp(self):
+        """Create clean environment with one of each parent record before each test"""
+        db.drop_all_tables(with_all_data=True)
+        db.create_tables()
+        with db_session:
+            Person(id=1, harvest_id=1111111, first_name='John', last_name='Doe')
+            Client(id=1, harvest_id=5555555, name='Acme')
+            Project(id=1, harvest_id=6666666, name='Rocket', client_id=1)
+            Task(id=1, name='Build')
+
+        # Swap in the mock classes that return dummy data
+        self.gc = GarbageCollector()
+        self.gc.harv = MockHarvester()
+        self.gc.fore = MockForecaster()
+
+    def test_sync_forecast_assignments(self):
+        """Split assignments whose parent is gone from Forecast are deleted, the rest are kept"""
+        for sync_mode in ['server', 'local']:
+            self.gc.sync_mode = sync_mode
+            self.check_sync_forecast_assignments()
+
+    def test_sync_harvest_time_entries(self):
+        """Recent time entries missing from Harvest are deleted, older ones are left alone"""
+        for sync_mode in ['server', 'local']:
+            self.gc.sync_mode = sync_mode
+            self.check_sync_harvest_time_entries()
+
+    def test_sync_time_entries_from_snapshot(self):
+        """Time entry ids munge_time_entries already pulled this run are used instead of pulling again"""
+        self.gc.snapshot = SourceSnapshot()
+        since = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        self.gc.snapshot.record_time_entries(since=since, ids=[111111111, 222222222])
+        # Any pull would fail
+        self.gc.harv = None
+        self.check_sync_harvest_time_entries()
+
+    @db_session
+    def check_sync_forecast_assignments(self):
+        Time_Assignment.select().delete(bulk=True)
+        for parent_id in [90111111, 12014616, 555, 556, None]:
+            Time_Assignment(parent_id=parent_id, person_id=1, project_id=1, assign_date=date(2018, 6, 1),
+                            allocation=8, updated_at=datetime(2018, 6, 1))
+        db.commit()
+
+        self.gc.sync_forecast_assignments()
+        kept = select(a.parent_id for a in Time_Assignment)[:]
+        self.assertEqual(sorted(kept), [12014616, 90111111])
+
+    @db_session
+    def check_sync_harvest_time_entries(self):
+        Time_Entry.select().delete(bulk=True)
+        recent = datetime.now() - timedelta(days=1)
+        old = datetime.now() - timedelta(days=60)
+        for entry_id, updated_at in [(111111111, recent), (222222222, recent), (444, recent), (555, old)]:
+            Time_Entry(id=entry_id, spent_date=date(2018, 6, 1), hours=1, updated_at=updated_at, person_id=1,
+                       project_id=1, client_id=1, task_id=1)
+        db.commit()
+
+        self.gc.sync_harvest_time_entries()
+        kept = select(te.id for te in Time_Entry)[:]
+        self.assertEqual(sorted(kept), [555, 111111111, 222222222])
+
+
+if __name__ == '__main__':
+    utmain()
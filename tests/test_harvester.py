@@ -0,0 +1,237 @@
+from unittest import TestCase, main as utmain
+from time import monotonic
+from controllers.datagrabber import Harvester, RequestScheduler, CachedSession, SourceSnapshot
+
+
+def make_page(page, total_pages, per_page=2):
+    """Builds a fake Harvest v2 page of time entries"""
+    first_id = (page - 1) * per_page + 1
+    entries = [{'id': i, 'hours': 1.0, 'user': {'id': 10, 'name': 'John Doe', 'email': 'x'}}
+               for i in range(first_id, first_id + per_page)]
+    if page < total_pages:
+        next_link = 'https://api.harvestapp.com/v2/time_entries?page={}'.format(page + 1)
+    else:
+        next_link = None
+    return {'time_entries': entries, 'page': page, 'total_pages': total_pages,
+            'total_entries': total_pages * per_page, 'links': {'next': next_link}}
+
+
+class TestHarvester(TestCase):
+    """Tests for the Harvest pagination done by Harvester"""
+
+    def setUp(self):
+        self.requested_pages = []
+        self.harv = Harvester(is_test=True, concurrency=4)
+        # No need to space out requests that never leave the building
+        self.harv.scheduler = RequestScheduler(rate_limit=100000, rate_window=1)
+        self.harv.__get_request__ = self.fake_get_request
+
+    def fake_get_request(self, api_url, extra_params=None):
+        if api_url.startswith('http'):
+            page = int(api_url.split('page=')[1])
+        else:
+            page = extra_params['page']
+        self.requested_pages.append(page)
+        return make_page(page=page, total_pages=5)
+
+    def test_first_page_fetched_once(self):
+        """Page 1 is used for the page count and its entries, so it should only be requested once"""
+        self.harv.__get_api_data__(root_key='time_entries', filters=['id', 'hours', 'user'])
+        self.assertEqual(sorted(self.requested_pages), [1, 2, 3, 4, 5])
+
+    def test_concurrent_pages_keep_order(self):
+        """Entries come back in page order no matter which page finished first"""
+        result = self.harv.__get_api_data__(root_key='time_entries', filters=['id', 'hours', 'user'])
+        ids = [entry['id'] for entry in result['time_entries']]
+        self.assertEqual(ids, list(range(1, 11)))
+        self.assertEqual(result['time_entries'][0]['user_name'], 'John Doe')
+
+    def test_serial_mode(self):
+        """A concurrency of 1 walks the pages one at a time"""
+        self.harv.concurrency = 1
+        result = self.harv.__get_api_data__(root_key='time_entries', filters=['id', 'hours', 'user'])
+        self.assertEqual(self.requested_pages, [1, 2, 3, 4, 5])
+        self.assertEqual(len(result['time_entries']), 10)
+
+    def test_links_pagination(self):
+        """Following links.next walks every page once and in order"""
+        self.harv.pagination = 'links'
+        result = self.harv.__get_api_data__(root_key='time_entries', filters=['id', 'hours', 'user'])
+        ids = [entry['id'] for entry in result['time_entries']]
+        self.assertEqual(self.requested_pages, [1, 2, 3, 4, 5])
+        self.assertEqual(ids, list(range(1, 11)))
+
+    def test_shifted_entries_skipped(self):
+        """An entry that shifts onto the next page mid-pull is only kept once, and counted as a duplicate"""
+        def shifted_get_request(api_url, extra_params=None):
+            page = make_page(page=extra_params['page'], total_pages=3)
+            if extra_params['page'] > 1:
+                page['time_entries'].insert(0, {'id': page['time_entries'][0]['id'] - 1, 'hours': 1.0})
+            return page
+        self.harv.__get_request__ = shifted_get_request
+
+        result = self.harv.__get_api_data__(root_key='time_entries', filters=['id', 'hours', 'user'])
+        ids = [entry['id'] for entry in result['time_entries']]
+        self.assertEqual(ids, list(range(1, 7)))
+        self.assertEqual(result['duplicates_skipped'], 2)
+        self.assertEqual(self.harv.duplicates_skipped['time_entries'], 2)
+
+    def test_iter_time_entries_is_lazy(self):
+        """The iterator only requests a page once the entries before it have been used"""
+        self.harv.concurrency = 1
+        entries = self.harv.iter_harvest_time_entries(updated_since='1984-12-31T00:00:00Z')
+        first = next(entries)
+        self.assertEqual(first['id'], 1)
+        self.assertEqual(self.requested_pages, [1])
+        self.assertEqual(len(list(entries)), 9)
+
+    def test_concurrent_iter_fetches_a_bounded_window(self):
+        """With page workers, no more than concurrency pages are fetched ahead of the entries being used"""
+        self.harv.concurrency = 2
+        entries = self.harv.iter_harvest_time_entries(updated_since='1984-12-31T00:00:00Z')
+        # Page 2's first entry, pages 3 and 4 may be in flight but page 5 must wait
+        taken = [next(entries) for i in range(3)]
+        self.assertEqual([entry['id'] for entry in taken], [1, 2, 3])
+        self.assertNotIn(5, self.requested_pages)
+        self.assertEqual(len(list(entries)), 7)
+        self.assertEqual(sorted(self.requested_pages), [1, 2, 3, 4, 5])
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, text='{}', headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception('HTTP {}'.format(self.status_code))
+
+
+class FakeSession(object):
+    """Hands back the queued responses in order and counts the calls"""
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+        self.sent_headers = []
+        self.sent_timeouts = []
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        self.calls += 1
+        self.sent_headers.append(headers or {})
+        self.sent_timeouts.append(timeout)
+        return self.responses.pop(0)
+
+
+class TestRequestScheduler(TestCase):
+    """Tests for the token bucket and retry handling shared by the grabbers"""
+
+    def setUp(self):
+        self.scheduler = RequestScheduler(rate_limit=100000, rate_window=1, max_retries=3, backoff_base=0)
+
+    def test_retries_throttled_request(self):
+        """A 429 with Retry-After is retried and the good response is returned"""
+        session = FakeSession([FakeResponse(429, headers={'Retry-After': '0'}), FakeResponse(503),
+                               FakeResponse(200, text='{"ok": true}')])
+        r = self.scheduler.get(session=session, url='http://localhost/users')
+        self.assertEqual(r.text, '{"ok": true}')
+        self.assertEqual(session.calls, 3)
+
+    def test_gives_up_after_max_retries(self):
+        session = FakeSession([FakeResponse(500) for i in range(4)])
+        with self.assertRaises(Exception):
+            self.scheduler.get(session=session, url='http://localhost/users')
+        self.assertEqual(session.calls, 4)
+
+    def test_client_errors_not_retried(self):
+        session = FakeSession([FakeResponse(401), FakeResponse(200)])
+        with self.assertRaises(Exception):
+            self.scheduler.get(session=session, url='http://localhost/users')
+        self.assertEqual(session.calls, 1)
+
+    def test_window_never_exceeds_limit(self):
+        """No rate_window sees more than rate_limit sends, the first one included"""
+        scheduler = RequestScheduler(rate_limit=3, rate_window=0.2)
+        start = monotonic()
+        sends = []
+        for i in range(7):
+            scheduler.acquire()
+            sends.append(monotonic() - start)
+
+        self.assertLess(sends[2], 0.1)
+        for i in range(3, 7):
+            self.assertGreaterEqual(sends[i] - sends[i - 3], 0.2)
+
+    def test_requests_sent_with_timeout(self):
+        session = FakeSession([FakeResponse(200)])
+        RequestScheduler(rate_limit=10, rate_window=1, timeout=(1, 5)).get(session=session, url='http://localhost/users')
+        self.assertEqual(session.sent_timeouts, [(1, 5)])
+
+
+class TestCachedSession(TestCase):
+    """Tests for the conditional GETs made to reference endpoints"""
+
+    def test_not_modified_served_from_cache(self):
+        session = FakeSession([FakeResponse(200, text='{"people": [1]}', headers={'ETag': 'W/"v1"'}),
+                               FakeResponse(304)])
+        cached = CachedSession(session, paths=['/people'])
+        url = 'http://cache.test/people'
+
+        self.assertEqual(cached.get(url=url, params={'page': 1}).text, '{"people": [1]}')
+        r = cached.get(url=url, params={'page': 1})
+        self.assertEqual((r.status_code, r.text), (200, '{"people": [1]}'))
+        self.assertEqual(session.sent_headers[1].get('If-None-Match'), 'W/"v1"')
+
+    def test_other_requests_pass_through(self):
+        """Paths not listed, and responses without validators, are never made conditional"""
+        session = FakeSession([FakeResponse(200, text='{"n": 1}'), FakeResponse(200, text='{"n": 2}'),
+                               FakeResponse(200, headers={'ETag': '"e"'}), FakeResponse(200)])
+        cached = CachedSession(session, paths=['/clients'])
+
+        cached.get(url='http://cache.test/clients')
+        self.assertEqual(cached.get(url='http://cache.test/clients').text, '{"n": 2}')
+        cached.get(url='http://cache.test/v2/time_entries')
+        cached.get(url='http://cache.test/v2/time_entries')
+        self.assertEqual([h.get('If-None-Match') for h in session.sent_headers], [None, None, None, None])
+
+
+class TestSourceSnapshot(TestCase):
+    """Tests for the per-run sharing of responses between UberMunge and GarbageCollector"""
+
+    def test_identical_requests_fetched_once(self):
+        session = FakeSession([FakeResponse(429), FakeResponse(200, text='{"assignments": [1]}'),
+                               FakeResponse(200, text='{"assignments": [2]}')])
+        snapshot_session = SourceSnapshot().session(session)
+        url = 'http://snapshot.test/assignments'
+
+        self.assertEqual(snapshot_session.get(url=url, params={'start_date': '2018-09-01'}).status_code, 429)
+        self.assertEqual(snapshot_session.get(url=url, params={'start_date': '2018-09-01'}).text,
+                         '{"assignments": [1]}')
+        self.assertEqual(snapshot_session.get(url=url + '?start_date=2018-09-01').text, '{"assignments": [1]}')
+        self.assertEqual(snapshot_session.get(url=url, params={'start_date': '2018-10-01'}).text,
+                         '{"assignments": [2]}')
+        self.assertEqual(session.calls, 3)
+
+    def test_hits_skip_the_rate_limit(self):
+        """A page already pulled this run is handed back without a rate limit token or a request"""
+        session = FakeSession([FakeResponse(200, text='{"people": [1]}')])
+        snapshot_session = SourceSnapshot().session(session)
+        scheduler = RequestScheduler(rate_limit=1, rate_window=3600)
+
+        scheduler.get(session=snapshot_session, url='http://snapshot.test/people')
+        # The one request an hour is spent, only a snapshot hit can come back now
+        r = scheduler.get(session=snapshot_session, url='http://snapshot.test/people')
+        self.assertEqual(r.text, '{"people": [1]}')
+        self.assertEqual(session.calls, 1)
+        self.assertEqual(len(scheduler.sent), 1)
+
+    def test_time_entry_pages_not_kept(self):
+        session = FakeSession([FakeResponse(200), FakeResponse(200)])
+        snapshot_session = SourceSnapshot().session(session)
+        snapshot_session.get(url='http://snapshot.test/v2/time_entries', params={'page': 1})
+        snapshot_session.get(url='http://snapshot.test/v2/time_entries', params={'page': 1})
+        self.assertEqual(session.calls, 2)
+
+
+if __name__ == '__main__':
+    utmain()
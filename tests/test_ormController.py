@@ -0,0 +1,136 @@
+from unittest import TestCase, main as utmain
+from datetime import date, datetime
+import numpy as np
+from controllers.ormcontroller import *
+
+
+def make_entry(entry_id, person_id, hours=1.0):
+    """Builds a time entry dict the way UberMunge hands it to the db"""
+    return {'id': entry_id, 'spent_date': date(2018, 6, 1), 'hours': hours, 'billable': True, 'billable_rate': 100.0,
+            'created_at': datetime(2018, 6, 1, 9), 'updated_at': datetime(2018, 6, 1, 9), 'entry_amount': hours * 100,
+            'person_id': person_id, 'person_name': 'John Doe', 'project_id': 1, 'project_name': 'Rocket',
+            'project_code': 'RKT', 'client_id': 1, 'client_name': 'Acme', 'task_id': 1, 'task_name': 'Build'}
+
+
+class TestOrmController(TestCase):
+    """Tests for the bulk write functions in ormcontroller"""
+
+    def setUp(self):
+        """Create clean environment with one of each parent record before each test"""
+        db.drop_all_tables(with_all_data=True)
+        db.create_tables()
+        with db_session:
+            Person(id=1, harvest_id=1111111, first_name='John', last_name='Doe')
+            Client(id=1, harvest_id=5555555, name='Acme')
+            Project(id=1, harvest_id=6666666, name='Rocket', client_id=1)
+            Task(id=1, name='Build')
+
+    def test_upsert_time_entries_insert_and_update(self):
+        """New ids are inserted and existing ids are updated in place"""
+        failed = upsert_time_entries([make_entry(1, 1), make_entry(2, 1)])
+        self.assertEqual(failed, [])
+
+        failed = upsert_time_entries([make_entry(2, 1, hours=2.5), make_entry(3, 1)])
+        self.assertEqual(failed, [])
+
+        with db_session:
+            self.assertEqual(count(te for te in Time_Entry), 3)
+            self.assertEqual(float(Time_Entry[2].hours), 2.5)
+            self.assertEqual(Time_Entry[2].spent_date, date(2018, 6, 1))
+
+    def test_upsert_time_entries_isolates_bad_row(self):
+        """A row with a missing person fails on its own and the rest of the batch is still written"""
+        batch = [make_entry(i, 1) for i in range(1, 8)]
+        batch[4] = make_entry(5, 999)
+        failed = upsert_time_entries(batch)
+
+        self.assertEqual([entry_id for entry_id, error in failed], [5])
+        with db_session:
+            self.assertEqual(set(select(te.id for te in Time_Entry)), {1, 2, 3, 4, 6, 7})
+
+    def test_upsert_legacy_entries(self):
+        """Only the given entries are copied to harvest_entries, and copying again updates them"""
+        upsert_time_entries([make_entry(1, 1), make_entry(2, 1), make_entry(3, 1)])
+        upsert_legacy_entries([1, 2])
+        upsert_time_entries([make_entry(2, 1, hours=3.0)])
+        upsert_legacy_entries([2])
+
+        with db_session:
+            self.assertEqual(set(select(he.entry_id for he in Harvest_Entries)), {1, 2})
+            self.assertEqual(float(Harvest_Entries[2].hours), 3.0)
+            self.assertEqual(Harvest_Entries[2].user_name, 'John Doe')
+
+        delete_by_ids('harvest_entries', [1], key_column='entry_id')
+        with db_session:
+            self.assertEqual(set(select(he.entry_id for he in Harvest_Entries)), {2})
+
+    def test_insert_time_assignments(self):
+        """A columnar block of NumPy arrays lands as one row per day"""
+        block = {'parent_id': np.array([9, 9]), 'person_id': np.array([1, 1]), 'project_id': np.array([1, 1]),
+                 'assign_date': np.array(['2018-06-01', '2018-06-04'], dtype='datetime64[D]'),
+                 'allocation': np.array([8.0, 8.0]), 'updated_at': np.array([datetime(2018, 6, 1)] * 2, dtype=object)}
+        insert_time_assignments(block)
+
+        with db_session:
+            dates = select(ta.assign_date for ta in Time_Assignment if ta.parent_id == 9).order_by(1)[:]
+            self.assertEqual(list(dates), [date(2018, 6, 1), date(2018, 6, 4)])
+
+    def test_replace_time_assignments(self):
+        """Every old row of the batch's parents is swapped for the new block, other parents are left alone"""
+        def block(parent_ids):
+            return {'parent_id': np.array(parent_ids), 'person_id': np.ones(len(parent_ids), dtype=int),
+                    'project_id': np.ones(len(parent_ids), dtype=int),
+                    'assign_date': np.array(['2018-06-01'] * len(parent_ids), dtype='datetime64[D]'),
+                    'allocation': np.full(len(parent_ids), 8.0),
+                    'updated_at': np.array([datetime(2018, 6, 1)] * len(parent_ids), dtype=object)}
+
+        insert_time_assignments(block([7, 7, 8, 8, 9]))
+        deleted = replace_time_assignments(parent_ids=[7, 8], assignment_block=block([7]))
+
+        self.assertEqual(deleted, 4)
+        with db_session:
+            self.assertEqual(sorted(select(ta.parent_id for ta in Time_Assignment)[:]), [7, 9])
+
+    def test_id_cache_resolves_source_ids(self):
+        """Harvest and Forecast ids both resolve to the data warehouse id, whether preloaded, added or missed"""
+        cache = IdCache()
+        cache.load()
+        self.assertEqual(cache.resolve(Person, 1111111), 1)
+        self.assertEqual(cache.resolve(Project, 6666666), 1)
+        self.assertIsNone(cache.resolve(Client, 123))
+
+        with db_session:
+            forecast_person = Person(id=2, forecast_id=722222, first_name='CJ')
+            db.commit()
+            cache.add(forecast_person)
+            Client(id=2, harvest_id=7777777, name='Late Client')
+        self.assertEqual(cache.resolve(Person, 722222), 2)
+        # Written without telling the cache, so this one comes from the db fallback
+        self.assertEqual(cache.resolve(Client, 7777777), 2)
+
+    def test_watermarks(self):
+        """Missing marks are seeded from the table once, empty tables give None, and marks only move forward"""
+        upsert_time_entries([make_entry(1, 1)])
+        marks = get_updated_from_dates()
+        self.assertEqual(marks['time_entry'], datetime(2018, 6, 1, 9))
+        self.assertIsNone(marks['time_assignment'])
+
+        set_watermark(name='time_entry', high_water=datetime(2018, 7, 1))
+        set_watermark(name='time_entry', high_water=datetime(2018, 5, 1))
+        set_watermark(name='time_assignment', high_water=datetime(2018, 6, 2))
+        marks = get_updated_from_dates()
+        self.assertEqual(marks['time_entry'], datetime(2018, 7, 1))
+        self.assertEqual(marks['time_assignment'], datetime(2018, 6, 2))
+
+    def test_verify_indexes(self):
+        """An index missing from an existing table is reported, and schema generation puts it back"""
+        self.assertEqual(verify_indexes(), [])
+        with db_session:
+            db.execute('DROP INDEX idx_time_entry__updated_at_id')
+        self.assertEqual(verify_indexes(), ['idx_time_entry__updated_at_id'])
+
+        db.create_tables()
+        self.assertEqual(verify_indexes(), [])
+
+if __name__ == '__main__':
+    utmain()
@@ -0,0 +1,61 @@
+from unittest import TestCase, main as utmain
+from threading import Event
+from controllers.datapusher import Stage, StageRunner
+
+
+class TestStageRunner(TestCase):
+    """Tests for the dependency ordering PusherBot uses to run load stages"""
+
+    def setUp(self):
+        self.ran = []
+        self.runner = StageRunner(max_workers=4)
+
+    def record(self, name):
+        return lambda: self.ran.append(name)
+
+    def test_dependencies_run_first(self):
+        stages = [Stage('project', self.record('project'), depends_on=['client']),
+                  Stage('client', self.record('client'), depends_on=['extract_client']),
+                  Stage('extract_client', self.record('extract_client'))]
+        stage_times = self.runner.run(stages)
+
+        self.assertEqual(self.ran, ['extract_client', 'client', 'project'])
+        self.assertEqual(set(stage_times.keys()), {'extract_client', 'client', 'project'})
+
+    def test_independent_stages_overlap(self):
+        """Two stages with no dependencies are running at the same time"""
+        people_started = Event()
+        clients_started = Event()
+
+        def people():
+            people_started.set()
+            self.assertTrue(clients_started.wait(timeout=5))
+
+        def clients():
+            clients_started.set()
+            self.assertTrue(people_started.wait(timeout=5))
+
+        self.runner.run([Stage('person', people), Stage('client', clients)])
+
+    def test_stages_outside_the_run_are_ignored(self):
+        """A time entry only load doesn't wait on person/project stages it isn't running"""
+        self.runner.run([Stage('time_entries', self.record('time_entries'), depends_on=['person', 'project'])])
+        self.assertEqual(self.ran, ['time_entries'])
+
+    def test_failure_stops_dependents(self):
+        def broken():
+            raise RuntimeError('no clients today')
+
+        stages = [Stage('client', broken), Stage('project', self.record('project'), depends_on=['client'])]
+        with self.assertRaises(RuntimeError):
+            self.runner.run(stages)
+        self.assertEqual(self.ran, [])
+
+    def test_cycle_raises(self):
+        stages = [Stage('a', self.record('a'), depends_on=['b']), Stage('b', self.record('b'), depends_on=['a'])]
+        with self.assertRaises(ValueError):
+            self.runner.run(stages)
+
+
+if __name__ == '__main__':
+    utmain()
@@ -0,0 +1,93 @@
+from unittest import TestCase, main as utmain
+from benchmarks.synthetic_data import SyntheticSource, SyntheticSession
+from benchmarks.api_server import StandInServer
+from controllers.datagrabber import Harvester, Forecaster, RequestScheduler, make_http_session
+
+
+class TestSyntheticData(TestCase):
+    """Tests that the benchmark data generator looks like the live APIs to the real grabbers"""
+
+    def setUp(self):
+        self.source = SyntheticSource.at_scale('tiny', time_entries=250)
+
+    def make_harvester(self, source, **kwargs):
+        harv = Harvester(**kwargs)
+        harv.session = SyntheticSession(source)
+        harv.scheduler = RequestScheduler(rate_limit=100000, rate_window=1)
+        return harv
+
+    def test_same_seed_same_data(self):
+        again = SyntheticSource.at_scale('tiny', time_entries=250, anchor=self.source.anchor)
+        url = 'https://api.harvestapp.com/v2/time_entries'
+        self.assertEqual(self.source.respond(url, {'page': 2}), again.respond(url, {'page': 2}))
+
+    def test_harvester_pulls_every_time_entry(self):
+        """Pages and links pagination both walk the whole set, entries come out flattened"""
+        for pagination in ['pages', 'links']:
+            harv = self.make_harvester(self.source, pagination=pagination)
+            entries = list(harv.iter_harvest_time_entries(updated_since='1984-12-31T00:00:00Z'))
+            self.assertEqual(len({entry['id'] for entry in entries}), 250)
+            self.assertIn('user_id', entries[0])
+
+    def test_updated_since_and_deletes(self):
+        """updated_since cuts the entries down by minute, and deleted_percent leaves some out"""
+        harv = self.make_harvester(self.source)
+        since = self.source.first_entry_at.replace(microsecond=0) + (self.source.anchor - self.source.first_entry_at) / 2
+        entries = harv.get_harvest_time_entries(updated_since=since.strftime('%Y-%m-%dT%H:%M:%SZ'))['time_entries']
+        # updated_since is inclusive, so the entry updated at exactly since is kept too
+        self.assertEqual(len(entries), 126)
+
+        deleted = SyntheticSource.at_scale('tiny', time_entries=250, deleted_percent=10, anchor=self.source.anchor)
+        kept = list(self.make_harvester(deleted).iter_harvest_time_entries(updated_since='1984-12-31T00:00:00Z'))
+        self.assertTrue(200 < len(kept) < 250)
+
+    def test_forecast_links_to_harvest(self):
+        fore = Forecaster()
+        fore.session = SyntheticSession(self.source)
+        fore.scheduler = RequestScheduler(rate_limit=100000, rate_window=1)
+        people = fore.get_forecast_people()['people']
+
+        harvest_ids = [person['harvest_id'] for person in people]
+        self.assertEqual(harvest_ids.count(None), 1)
+        self.assertEqual(harvest_ids[1], self.source.harvest['users'][1]['id'])
+
+
+class TestStandInServer(TestCase):
+    """Tests the real grabbers against the local HTTP stand-in for the APIs"""
+
+    def setUp(self):
+        self.source = SyntheticSource.at_scale('tiny', time_entries=450)
+        # Retry-After 0 and a short backoff keep the injected 429s from slowing the test down
+        self.scheduler = RequestScheduler(rate_limit=100000, rate_window=1, backoff_base=0.01)
+
+    def make_harvester(self, server):
+        harv = Harvester(concurrency=3)
+        harv.session = make_http_session(pool_size=3)
+        harv.scheduler = self.scheduler
+        harv.harvest_base_url = server.harvest_base_url
+        return harv
+
+    def test_pages_over_http_with_throttling(self):
+        """Every entry arrives once even though some pages were answered with a 429 first"""
+        with StandInServer(self.source, throttle_rate=0.3, retry_after=0, seed=7) as server:
+            harv = self.make_harvester(server)
+            entries = harv.get_harvest_time_entries(updated_since='1984-12-31T00:00:00Z')['time_entries']
+
+        self.assertEqual(len({entry['id'] for entry in entries}), 450)
+        self.assertGreater(server.throttled, 0)
+        self.assertEqual(server.requests, 5 + server.throttled)
+
+    def test_forecast_over_http(self):
+        with StandInServer(self.source, latency=0.01) as server:
+            fore = Forecaster()
+            fore.session = make_http_session(pool_size=1)
+            fore.scheduler = self.scheduler
+            fore.forecast_base_url = server.forecast_base_url
+            clients = fore.get_forecast_clients()['clients']
+
+        self.assertEqual(len(clients), len(self.source.forecast['clients']))
+        self.assertEqual(server.requests, 1)
+
+
+if __name__ == '__main__':
+    utmain()
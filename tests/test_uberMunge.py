@@ -1,5 +1,7 @@
 from unittest import TestCase, main as utmain
+from unittest.mock import patch
 from controllers.datamunger import UberMunge
+from controllers.datagrabber import SourceSnapshot
 from tests.mock_data.mock_harvest_apis import MockHarvester, MockForecaster
 from controllers.ormcontroller import db, db_session, select
 from controllers.ormobjects import *
@@ -79,6 +81,67 @@ class TestUberMunge(TestCase):
         self.assertEqual(p1.full_name, 'Tony VPDude')
         self.assertEqual(p1.roles, 'Mission Control')
 
+    def test_expand_business_days(self):
+        """Parents split into one row per weekday, inclusive of the start and end dates"""
+        parents = [{'parent_id': 1, 'person_id': 10, 'project_id': 20, 'allocation': 8.0, 'updated_at': None,
+                    'start_date': '2018-06-01', 'end_date': '2018-06-05'},  # Fri through Tue
+                   {'parent_id': 2, 'person_id': 11, 'project_id': 21, 'allocation': 4.0, 'updated_at': None,
+                    'start_date': '2018-06-09', 'end_date': '2018-06-10'},  # Weekend only
+                   {'parent_id': 3, 'person_id': 12, 'project_id': 22, 'allocation': 2.0, 'updated_at': None,
+                    'start_date': '2018-06-11', 'end_date': '2018-06-11'}]  # Single Monday
+        block = self.uber.__expand_business_days__(parents=parents)
+
+        dates = [str(d) for d in block['assign_date']]
+        self.assertEqual(dates, ['2018-06-01', '2018-06-04', '2018-06-05', '2018-06-11'])
+        self.assertEqual(list(block['parent_id']), [1, 1, 1, 3])
+        self.assertEqual(list(block['allocation']), [8.0, 8.0, 8.0, 2.0])
+
+    def test_match_forecast_results(self):
+        """Every Harvest record finds its Forecast twin, even neighbouring ones, and the rest come back as leftovers"""
+        harvest = [{'harvest_id': 1}, {'harvest_id': 2}, {'harvest_id': 3}]
+        forecast = [{'id': 10, 'harvest_id': 1}, {'id': 20, 'harvest_id': 2}, {'id': 30, 'harvest_id': None},
+                    {'id': 40, 'harvest_id': 4}]
+        leftovers = self.uber.__match_forecast_results__(h_result_set=harvest, f_result_set=forecast)
+
+        self.assertEqual([h.get('forecast_id') for h in harvest], [10, 20, None])
+        self.assertEqual([f['id'] for f in leftovers], [30, 40])
+
+    def test_share_time_entries(self):
+        """Only entries past the watermark are written, the ids of every entry in the sync window are recorded"""
+        self.uber.snapshot = SourceSnapshot(time_entry_window='2018-09-01T00:00:00Z')
+        entries = [{'id': 1, 'updated_at': '2018-08-30T00:00:00Z'}, {'id': 2, 'updated_at': '2018-09-02T00:00:00Z'},
+                   {'id': 3, 'updated_at': '2018-09-10T00:00:00Z'}]
+        written = self.uber.__share_time_entries__(entries=iter(entries), window='2018-09-01T00:00:00Z',
+                                                   write_since='2018-09-05T00:00:00Z')
+
+        self.assertEqual([entry['id'] for entry in written], [3])
+        self.assertEqual(self.uber.snapshot.time_entries_since('2018-09-03T00:00:00Z'), [2, 3])
+        self.assertIsNone(self.uber.snapshot.time_entries_since('2018-08-01T00:00:00Z'))
+
+    @db_session
+    def test_failed_forecast_lookup_not_cached(self):
+        """A Forecast client whose lookup fails is skipped, not mistaken for the record before it"""
+        client_get = Client.get
+
+        def flaky_get(**kwargs):
+            if kwargs.get('forecast_id') == 7001:
+                raise RuntimeError('lookup failed')
+            return client_get(**kwargs)
+
+        orphans = [{'id': 7001, 'name': 'Twin', 'harvest_id': None, 'archived': False,
+                    'updated_at': '2018-07-01T00:00:00.000Z'},
+                   {'id': 7002, 'name': 'Orphan Co', 'harvest_id': None, 'archived': False,
+                    'updated_at': '2018-07-01T00:00:00.000Z'},
+                   {'id': 7001, 'name': 'Twin', 'harvest_id': None, 'archived': False,
+                    'updated_at': '2018-07-01T00:00:00.000Z'}]
+        cached = []
+        self.uber.id_cache.add = lambda record: cached.append(record.forecast_id)
+        self.uber.extracts.update(client=({'clients': []}, {'clients': orphans}))
+        with patch.object(Client, 'get', side_effect=flaky_get):
+            self.uber.munge_client()
+
+        self.assertEqual(cached, [7002])
+
     def test_munge_client(self):
         self.fail()
 
@@ -0,0 +1,121 @@
+from unittest import TestCase, main as utmain
+from io import StringIO
+from controllers.utilitybot import LoggerBot, LoadMetrics, ProgressReporter, chunked, percentile, metrics
+from controllers.ormcontroller import db, db_session, select
+from controllers.ormobjects import DataRocketLog
+
+
+class TestLoadMetrics(TestCase):
+    """Tests for the run instrumentation in utilitybot"""
+
+    def setUp(self):
+        self.metrics = LoadMetrics()
+
+    def test_counts_go_to_innermost_stage(self):
+        @self.metrics.timed
+        def munge_person():
+            self.metrics.count('rows_inserted', 3)
+            with self.metrics.stage('get_harvest_users'):
+                self.metrics.count('rows_updated')
+            self.metrics.count('rows_updated', 2)
+
+        munge_person()
+        munge_person()
+        stages = self.metrics.summary()['stages']
+
+        self.assertEqual(stages['munge_person']['calls'], 2)
+        self.assertEqual(stages['munge_person']['rows_inserted'], 6)
+        self.assertEqual(stages['munge_person']['rows_updated'], 4)
+        self.assertEqual(stages['get_harvest_users']['rows_updated'], 2)
+        self.assertIn('rows_per_sec', stages['munge_person'])
+
+    def test_endpoint_latency_percentiles(self):
+        for ms in range(1, 101):
+            self.metrics.record_request(endpoint='time_entries', seconds=ms / 1000, retries=1 if ms == 100 else 0)
+        self.metrics.count_endpoint(endpoint='time_entries', counter='duplicates_skipped', amount=4)
+        ep = self.metrics.summary()['endpoints']['time_entries']
+
+        self.assertEqual(ep['pages'], 100)
+        self.assertEqual(ep['retries'], 1)
+        self.assertEqual(ep['duplicates_skipped'], 4)
+        self.assertEqual(ep['latency_p50_ms'], 50.0)
+        self.assertEqual(ep['latency_p99_ms'], 99.0)
+
+    def test_percentile_empty(self):
+        self.assertEqual(percentile([], 90), 0)
+
+    def test_chunked(self):
+        self.assertEqual(list(chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+
+class TestLoggerBot(TestCase):
+    """Tests for the error buffer in LoggerBot"""
+
+    def setUp(self):
+        db.drop_all_tables(with_all_data=True)
+        db.create_tables()
+        self.logger = LoggerBot(error_sample_size=2)
+
+    def test_errors_flush_as_one_row_per_stage(self):
+        with metrics.stage('munge_test'):
+            for record_id in range(5):
+                self.logger.record_error(description='Test Entry Error', record_id=record_id, error=KeyError('id'))
+            self.logger.record_error(description='Test Entry Error', record_id=9, error='No person',
+                                     error_type='MissingForeignKey')
+        self.logger.flush_errors('munge_test')
+        self.logger.flush_errors('munge_test')
+
+        with db_session:
+            logs = select(log for log in DataRocketLog)[:]
+            self.assertEqual(len(logs), 1)
+            doc = logs[0].event_documents
+            self.assertEqual(doc['error_count'], 6)
+            self.assertEqual(doc['by_type'], {'KeyError': 5, 'MissingForeignKey': 1})
+            self.assertEqual([sample['id'] for sample in doc['samples']], ['0', '1'])
+            self.assertEqual(doc['samples_dropped'], 4)
+
+
+class TestProgressReporter(TestCase):
+    """Tests for the throttled progress output"""
+
+    def test_log_lines_are_throttled(self):
+        """Off a terminal a long loop prints one line when done instead of one per record"""
+        stream = StringIO()
+        progress = ProgressReporter(total=100000, prefix='People', stream=stream, is_tty=False, log_seconds=60)
+        for idx in range(100000):
+            progress.update(idx + 1)
+
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].startswith('progress="People" done=100000 total=100000 pct=100.0 rate='))
+
+    def test_bar_moves_by_step(self):
+        """On a terminal the bar is redrawn once per step_percent, even for a slow loop"""
+        stream = StringIO()
+        progress = ProgressReporter(total=1000, stream=stream, is_tty=True, max_hz=float('inf'), step_percent=10)
+        for idx in range(1000):
+            progress.update(idx + 1)
+
+        self.assertEqual(stream.getvalue().count('\r'), 11)
+        self.assertTrue(stream.getvalue().endswith('100.0% Complete (1000 Records)\nAll Done\n'))
+
+    def test_last_record_reported_off_step(self):
+        """A total that isn't a multiple of the step still finishes the bar and logs the last record"""
+        stream = StringIO()
+        progress = ProgressReporter(total=251, stream=stream, is_tty=True, max_hz=float('inf'), step_percent=10)
+        for idx in range(251):
+            progress.update(idx + 1)
+
+        self.assertTrue(progress.finished)
+        self.assertEqual(stream.getvalue().count('\r'), 12)
+        self.assertTrue(stream.getvalue().endswith('100.0% Complete (251 Records)\nAll Done\n'))
+
+        stream = StringIO()
+        progress = ProgressReporter(total=251, prefix='Pages', stream=stream, is_tty=False, log_seconds=60)
+        for idx in range(251):
+            progress.update(idx + 1)
+        self.assertEqual(stream.getvalue().splitlines()[-1].split()[1], 'done=251')
+
+
+if __name__ == '__main__':
+    utmain()